@@ -1,22 +1,1652 @@
+import time
+# 启动计时的起点，用于统计从启动到窗口显示、恢复上次文件的耗时
+STARTUP_TIME = time.perf_counter()
+
 import os
+import sys
+import importlib
 import tkinter as tk
 from tkinter import ttk, messagebox
-from PIL import Image, ImageTk
 import json
-import winreg
+import tempfile
+import select
+import struct
+import ctypes
+import ctypes.util
+import mmap
+import hashlib
+import math
+import argparse
+import sqlite3
 import threading
-import time
+import queue
+import multiprocessing
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+
+class LazyModule:
+    """首次访问属性时才导入的模块，Pillow等较慢的导入推迟到窗口显示之后"""
+    
+    def __init__(self, name):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'module', None)
+    
+    def load(self):
+        module = self.module
+        if module is None:
+            module = importlib.import_module(self.name)
+            object.__setattr__(self, 'module', module)
+        return module
+    
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+    
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+Image = LazyModule('PIL.Image')
+ImageTk = LazyModule('PIL.ImageTk')
+ImageDraw = LazyModule('PIL.ImageDraw')
+ImageFont = LazyModule('PIL.ImageFont')
+cProfile = LazyModule('cProfile')
+pstats = LazyModule('pstats')
+
+# 支持的图片格式
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+class Tracer:
+    """渲染路径的性能跟踪：记录各阶段的耗时，可导出为Chrome跟踪格式（chrome://tracing、Perfetto）
+    
+    事件保存在固定长度的环形缓冲区中，一直记录，开销只有两次计时和一次追加。
+    """
+    
+    def __init__(self, max_events=100000):
+        self.events = deque(maxlen=max_events)  # (名称, 类别, 开始时间, 耗时, 线程, 参数)
+        self.last = {}  # 阶段 -> 最近一次的耗时（秒）
+        self.thread_names = {}
+        self.origin = time.perf_counter()
+    
+    @contextmanager
+    def span(self, name, category='render', **args):
+        """记录with块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter() - start, args)
+    
+    def record(self, name, category, start, duration, args=None):
+        thread = threading.current_thread()
+        self.thread_names.setdefault(thread.ident, thread.name)
+        self.events.append((name, category, start, duration, thread.ident, args or {}))
+        self.last[name] = duration
+    
+    def export(self, path):
+        """把记录的事件写入Chrome跟踪格式的JSON文件"""
+        pid = os.getpid()
+        trace_events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in list(self.thread_names.items())
+        ]
+        for name, category, start, duration, tid, args in list(self.events):
+            trace_events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1000000, 1),
+                'dur': round(duration * 1000000, 1),
+                'pid': pid,
+                'tid': tid,
+                'args': {key: str(value) for key, value in args.items()}
+            })
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        atomic_write_text(path, json.dumps({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}))
+        return len(trace_events)
+
+# 全局的跟踪器，模块中的缓存和查看器共用
+TRACER = Tracer()
+
+class PacingStats:
+    """记录定时回调的实际间隔和延迟，用于确认自动滚动的帧率是否稳定"""
+    
+    def __init__(self, interval, history=600):
+        self.interval = interval
+        self.intervals = deque(maxlen=history)  # 相邻两次回调的实际间隔（秒）
+        self.lateness = deque(maxlen=history)   # 每次回调比目标时刻晚了多久（秒）
+        self.frames = 0
+        self.dropped = 0
+        self.last_time = None
+    
+    def record(self, now, deadline, dropped):
+        if self.last_time is not None:
+            self.intervals.append(now - self.last_time)
+        self.last_time = now
+        self.lateness.append(now - deadline)
+        self.frames += 1
+        self.dropped += dropped
+    
+    def summary(self):
+        """最近一段时间的间隔统计（毫秒）：平均值、标准差（抖动）、99百分位、最大值和最大延迟"""
+        intervals = sorted(self.intervals)
+        if not intervals:
+            return None
+        mean = sum(intervals) / len(intervals)
+        return {
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'mean_ms': mean * 1000,
+            'jitter_ms': math.sqrt(sum((x - mean) ** 2 for x in intervals) / len(intervals)) * 1000,
+            'p99_ms': intervals[min(len(intervals) - 1, int(len(intervals) * 0.99))] * 1000,
+            'max_ms': intervals[-1] * 1000,
+            'max_late_ms': max(self.lateness) * 1000
+        }
+
+class FrameScheduler:
+    """以固定间隔调用callback(now, tick)的定时器
+    
+    第n次回调的目标时刻固定为 origin + n * interval，每次都按单调时钟重新计算到下一个目标时刻的等待时间，
+    某一次回调晚了不会使后面的回调跟着推迟，误差不会累积。落后超过一个间隔时跳过错过的回调，不连续补帧。
+    after/after_cancel 为Tk的同名方法，回调在界面线程中执行。
+    """
+    
+    def __init__(self, after, after_cancel, interval, callback, name='frame', clock=time.perf_counter):
+        self.after = after
+        self.after_cancel = after_cancel
+        self.interval = interval
+        self.callback = callback
+        self.name = name
+        self.clock = clock
+        self.timer = None
+        self.running = False
+        self.origin = None
+        self.tick = 0
+        self.stats = PacingStats(interval)
+    
+    def start(self, origin=None):
+        """从origin（默认为现在）开始计时，几个定时器使用同一个origin时相互对齐"""
+        self.stop()
+        self.origin = self.clock() if origin is None else origin
+        self.tick = 0
+        self.stats = PacingStats(self.interval)
+        self.running = True
+        self.fire()
+    
+    def stop(self):
+        self.running = False
+        if self.timer is not None:
+            self.after_cancel(self.timer)
+            self.timer = None
+    
+    def fire(self):
+        self.timer = None
+        if not self.running:
+            return
+        now = self.clock()
+        deadline = self.origin + self.tick * self.interval
+        # after()以毫秒计时，可能提前不到1ms触发，提前更多时补足剩余的等待
+        if now < deadline - 0.001:
+            self.schedule(deadline)
+            return
+        
+        dropped = max(0, int((now - deadline) / self.interval))
+        tick = self.tick + dropped
+        self.stats.record(now, self.origin + tick * self.interval, dropped)
+        with TRACER.span(self.name, category='performance', tick=tick):
+            self.callback(now, tick)
+        
+        self.tick = tick + 1
+        if self.running:
+            self.schedule(self.origin + self.tick * self.interval)
+    
+    def schedule(self, deadline):
+        delay_ms = max(0, int((deadline - self.clock()) * 1000))
+        self.timer = self.after(delay_ms, self.fire)
+
+def set_timer_resolution(high):
+    """Windows下演奏期间把系统定时器精度提高到1ms（默认约15.6ms），结束后恢复"""
+    if sys.platform != 'win32':
+        return
+    try:
+        winmm = ctypes.WinDLL('winmm')
+        if high:
+            winmm.timeBeginPeriod(1)
+        else:
+            winmm.timeEndPeriod(1)
+    except (OSError, AttributeError) as e:
+        print(f"无法设置定时器精度: {e}")
+
+def to_reducible_mode(image):
+    """调色板等模式不能直接按像素平均，reduce()之前先转换为真彩色，其他模式原样返回"""
+    if image.mode in ('1', 'P', 'PA', 'I;16'):
+        has_alpha = image.mode == 'PA' or 'transparency' in image.info
+        return image.convert('RGBA' if has_alpha else 'RGB')
+    return image
+
+class ImagePyramid:
+    """图像金字塔：按需生成逐级减半的缩小图，缩放时从最接近的较大级别重采样"""
+    
+    def __init__(self, image):
+        # levels[0] 为原图，之后每一级的宽高都是上一级的一半
+        self.levels = [image]
+        # 后台渲染线程和界面线程都会生成级别，需要加锁
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def reduced_size(size):
+        """计算图像缩小一半后的尺寸（与Image.reduce的取整方式一致）"""
+        return ((size[0] + 1) // 2, (size[1] + 1) // 2)
+    
+    def get_level(self, index):
+        """获取指定级别的图像，尚未生成的级别从上一级缩小得到"""
+        with self.lock:
+            while len(self.levels) <= index:
+                self.levels.append(to_reducible_mode(self.levels[-1]).reduce(2))
+            return self.levels[index]
+    
+    def resize(self, size, resample=None):
+        """把图像缩放到指定尺寸，尽量从较小的级别开始重采样，默认使用LANCZOS"""
+        if resample is None:
+            resample = Image.Resampling.LANCZOS
+        target_width, target_height = size
+        
+        # 找到尺寸仍不小于目标尺寸的最小级别
+        level = 0
+        level_size = self.levels[0].size
+        while True:
+            next_size = self.reduced_size(level_size)
+            if next_size[0] < target_width or next_size[1] < target_height:
+                break
+            level += 1
+            level_size = next_size
+        
+        image = self.get_level(level)
+        if image.size == tuple(size):
+            return image
+        return image.resize(size, resample)
+    
+    def preview_region(self, size, box, resample=None):
+        """快速生成缩放后图像中box区域的预览，默认使用NEAREST
+        
+        只使用已经生成的级别，并且只重采样box对应的源区域，耗时与区域大小成正比。
+        """
+        if resample is None:
+            resample = Image.Resampling.NEAREST
+        # 选择已生成级别中最小且不小于目标尺寸的一级
+        levels = list(self.levels)
+        image = levels[0]
+        for level in levels[1:]:
+            if level.size[0] < size[0] or level.size[1] < size[1]:
+                break
+            image = level
+        
+        # 把目标坐标换算到源图像坐标
+        ratio_x = image.size[0] / size[0]
+        ratio_y = image.size[1] / size[1]
+        left, top, right, bottom = box
+        source_box = (left * ratio_x, top * ratio_y, right * ratio_x, bottom * ratio_y)
+        return image.resize((right - left, bottom - top), resample, box=source_box)
+
+class ImageLRUCache:
+    """图像的LRU缓存，总字节数不超过预算
+    
+    注册到MemoryAccountant后，还受所有缓存共用的总预算限制，由它按全局最近最少使用的顺序淘汰。
+    """
+    
+    def __init__(self, max_bytes, accountant=None, name='cache'):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # 键 -> (图像, 字节数, 最近使用时刻)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.name = name
+        self.accountant = accountant
+        if accountant is not None:
+            accountant.register(self)
+    
+    @staticmethod
+    def image_bytes(image):
+        """估算解码后图像占用的字节数"""
+        bytes_per_band = 4 if image.mode in ('I', 'F') else 1
+        return image.size[0] * image.size[1] * len(image.getbands()) * bytes_per_band
+    
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+    
+    def touch(self, key):
+        """把条目标记为最近使用（调用时已持有锁）"""
+        image, nbytes, _ = self.entries[key]
+        self.entries[key] = (image, nbytes, time.monotonic())
+        self.entries.move_to_end(key)
+        return image
+    
+    def get(self, key):
+        """获取缓存的图像，未命中时返回None"""
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.touch(key)
+            self.misses += 1
+            return None
+    
+    def put(self, key, image):
+        """放入缓存，并按最近最少使用的顺序淘汰超出预算的图像"""
+        nbytes = self.image_bytes(image)
+        if nbytes > self.max_bytes:
+            return  # 单张图像超出预算时不缓存
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (image, nbytes, time.monotonic())
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                self.evict_oldest_locked()
+        if self.accountant is not None:
+            self.accountant.enforce()
+    
+    def evict_oldest_locked(self):
+        """淘汰最久未使用的图像（调用时已持有锁），返回释放的字节数"""
+        _, (_, evicted_bytes, _) = self.entries.popitem(last=False)
+        self.total_bytes -= evicted_bytes
+        return evicted_bytes
+    
+    def evict_oldest(self):
+        """淘汰最久未使用的图像，缓存已空时返回0"""
+        with self.lock:
+            return self.evict_oldest_locked() if self.entries else 0
+    
+    def oldest_time(self):
+        """最久未使用的图像的使用时刻，缓存为空时返回None"""
+        with self.lock:
+            if not self.entries:
+                return None
+            return next(iter(self.entries.values()))[2]
+    
+    def image_ids(self):
+        """缓存中所有图像的id，用于统计时排除界面同时持有的图像"""
+        with self.lock:
+            return {id(entry[0]) for entry in self.entries.values()}
+    
+    def stats(self):
+        """返回缓存统计信息，用于调整内存预算"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+class MemoryAccountant:
+    """所有内存中图像的总预算
+    
+    注册的缓存由这里统一按全局最近最少使用的顺序淘汰；界面正在显示的图像（当前图片、页面、PhotoImage等）
+    不能淘汰，按类别登记字节数，计入总量并挤占缓存的空间。缓存全部淘汰后仍超出预算时enforce()返回False，
+    由界面释放不可见的页面。
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.caches = []
+        self.live = {}  # 类别 -> 字节数
+        self.evictions = 0
+        self.lock = threading.Lock()
+    
+    def register(self, cache):
+        self.caches.append(cache)
+    
+    def set_live(self, **categories):
+        """登记界面持有的各类图像的字节数，并按新的总量淘汰缓存"""
+        self.live.update(categories)
+        return self.enforce()
+    
+    def cached_image_ids(self):
+        ids = set()
+        for cache in self.caches:
+            ids |= cache.image_ids()
+        return ids
+    
+    def total_bytes(self):
+        return sum(cache.total_bytes for cache in self.caches) + sum(self.live.values())
+    
+    def enforce(self):
+        """超出预算时从所有缓存中淘汰最久未使用的图像，只靠淘汰缓存无法满足预算时返回False"""
+        with self.lock:
+            while self.total_bytes() > self.max_bytes:
+                oldest_cache = None
+                oldest_time = None
+                for cache in self.caches:
+                    used = cache.oldest_time()
+                    if used is not None and (oldest_time is None or used < oldest_time):
+                        oldest_cache, oldest_time = cache, used
+                if oldest_cache is None or not oldest_cache.evict_oldest():
+                    return False
+                self.evictions += 1
+        return True
+    
+    def usage(self):
+        """各缓存和各类界面图像的字节数"""
+        usage = {cache.name: cache.total_bytes for cache in self.caches}
+        usage.update(self.live)
+        return usage
+
+class DecodedImageCache(ImageLRUCache):
+    """已解码图像的缓存，以(路径, 修改时间, 文件大小, 缩小倍数)为键，文件被修改后自动失效
+    
+    目标缩放比例小于1时按2的幂缩小解码：JPEG使用draft()直接以1/2、1/4、1/8解码，
+    其他格式解码后立即用reduce()缩小。原图尺寸记录在image.info['full_size']中。
+    """
+    
+    MAX_REDUCE_FACTOR = 8
+    
+    @staticmethod
+    def make_key(path):
+        """根据文件状态生成缓存键，文件被修改后键随之变化"""
+        stat = os.stat(path)
+        return (os.path.normcase(os.path.abspath(path)), stat.st_mtime, stat.st_size)
+    
+    @classmethod
+    def reduce_factor(cls, scale):
+        """计算缩放比例下可以缩小解码的倍数（2的幂，不超过8）"""
+        factor = 1
+        while factor < cls.MAX_REDUCE_FACTOR and scale * factor * 2 <= 1:
+            factor *= 2
+        return factor
+    
+    def load(self, path, scale=1.0):
+        """获取足以按scale显示的解码图像，未命中时从磁盘解码并放入缓存"""
+        file_key = self.make_key(path)
+        factor = self.reduce_factor(scale)
+        
+        # 已缓存的更高分辨率的解码结果同样可用
+        with self.lock:
+            candidate = factor // 2
+            while candidate >= 1:
+                if file_key + (candidate,) in self.entries:
+                    self.hits += 1
+                    return self.touch(file_key + (candidate,))
+                candidate //= 2
+        key = file_key + (factor,)
+        image = self.get(key)
+        if image is not None:
+            return image
+        
+        # 解码放在锁外，避免后台预读时阻塞界面线程
+        with TRACER.span('decode', path=path, factor=factor):
+            with Image.open(path) as image:
+                full_size = image.size
+                if factor > 1 and image.format == 'JPEG':
+                    image.draft(image.mode, (full_size[0] // factor, full_size[1] // factor))
+                image.load()
+            if factor > 1 and image.size == full_size:
+                image = to_reducible_mode(image).reduce(factor)
+        image.info['full_size'] = full_size
+        self.put(key, image)
+        return image
+
+def make_process_pool(max_workers=None):
+    """创建以spawn方式启动子进程的进程池
+    
+    查看器和批处理任务都有后台线程，在多线程的进程中fork可能复制被其他线程持有的锁而死锁；
+    spawn在各平台上的行为与Windows一致，子进程重新导入本模块，只执行不带界面的函数。
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+def atomic_write_text(path, text):
+    """先写入同目录下的临时文件，再原子替换目标文件，避免写到一半时留下损坏的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def open_unlimited_image(path):
+    """打开图像但不解码，不受Pillow解压炸弹限制的影响
+    
+    Pillow只在Image.open()读取文件头时检查像素数，锁只需要覆盖这一步；
+    之后的解码在锁外进行，不会阻塞其他线程读取图像尺寸。
+    """
+    with TiledImageStore.pixel_limit_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+def read_image_size(path):
+    """只读取文件头获取图像尺寸"""
+    with open_unlimited_image(path) as image:
+        return image.size
+
+# 页面布局：以下函数只做几何计算，不依赖Tk，查看器、预渲染、导出和性能测试共用
+#
+# 画布上的页面从左到右排列，每页宽度为图像宽度加上边框空间。页面图像的左上角位于(x, PAGE_MARGIN)，
+# 相邻两页在图像中重叠overlap像素，重叠部分用遮罩和红色分隔线标出。
+
+PAGE_MARGIN = 10  # 页面图像与画布顶端、页面左边界的距离
+
+# 单个页面的几何描述：
+#   index          页码（从0开始）
+#   box            页面在缩放后图像中的区域 (left, top, right, bottom)
+#   x              页面图像在画布上的左端
+#   border         边框矩形 (x0, y0, x1, y1)
+#   mask_ys        遮罩图像左上角的y坐标
+#   separator_ys   分隔线的y坐标，分隔线从x画到x + 图像宽度
+#   label_pos      页码文字的中心位置
+PageDescriptor = namedtuple('PageDescriptor', 'index box x border mask_ys separator_ys label_pos')
+
+def compute_page_layout(width, height, canvas_height, overlap_ratio):
+    """计算缩放后的图像按画布高度分页的参数"""
+    overlap = int(canvas_height * overlap_ratio)
+    effective_height = canvas_height - overlap
+    num_pages = (height + effective_height - 1) // effective_height
+    page_width = width + 20  # 添加边框空间
+    return {
+        'width': width,
+        'height': height,
+        'canvas_height': canvas_height,
+        'overlap_ratio': overlap_ratio,
+        'overlap': overlap,
+        'effective_height': effective_height,
+        'num_pages': num_pages,
+        'page_width': page_width,
+        'total_width': page_width * num_pages
+    }
+
+def get_page_box(layout, i):
+    """第i页在缩放后图像中的区域"""
+    start_y = i * layout['effective_height']
+    page_height = min(layout['canvas_height'], layout['height'] - start_y)
+    return (0, start_y, layout['width'], start_y + page_height)
+
+def get_page_descriptor(layout, i):
+    """第i页在画布上的几何描述"""
+    width = layout['width']
+    canvas_height = layout['canvas_height']
+    overlap = layout['overlap']
+    x = i * layout['page_width'] + PAGE_MARGIN
+    border_x = x - 5
+    
+    # 与上一页重叠的部分在页面顶部，与下一页重叠的部分在页面底部
+    top = overlap + PAGE_MARGIN
+    bottom = canvas_height - overlap + PAGE_MARGIN
+    if i == 0:
+        mask_ys = (bottom,)
+        separator_ys = (bottom,)
+    elif i < layout['num_pages'] - 1:
+        mask_ys = (PAGE_MARGIN, bottom)
+        separator_ys = (top, bottom)
+    else:
+        mask_ys = (PAGE_MARGIN,)
+        separator_ys = (top,)
+    
+    return PageDescriptor(
+        index=i,
+        box=get_page_box(layout, i),
+        x=x,
+        border=(border_x, 5, border_x + width + 10, canvas_height - 5),
+        mask_ys=mask_ys,
+        separator_ys=separator_ys,
+        label_pos=(border_x + width / 2 + 5, canvas_height - 20)
+    )
+
+# 重叠部分的标记颜色：浅绿色，不透明度25/255（约90%透明）
+OVERLAP_TINT_COLOR = (144, 238, 144)
+OVERLAP_TINT_ALPHA = 25 / 255
+
+def make_tint_lut(bands):
+    """生成Image.point()使用的查找表，颜色通道与标记颜色按不透明度混合，透明通道不变"""
+    lut = []
+    for band in range(bands):
+        if band < 3:
+            color = OVERLAP_TINT_COLOR[band]
+            lut.extend(round(v * (1 - OVERLAP_TINT_ALPHA) + color * OVERLAP_TINT_ALPHA) for v in range(256))
+        else:
+            lut.extend(range(256))
+    return lut
+
+OVERLAP_TINT_LUTS = {'RGB': make_tint_lut(3), 'RGBA': make_tint_lut(4)}
+
+def get_overlap_rows(layout, page):
+    """页面图像中与相邻页面重叠的行范围[(top, bottom)]，坐标相对于页面图像"""
+    return [(y - PAGE_MARGIN, y - PAGE_MARGIN + layout['overlap']) for y in page.mask_ys]
+
+def tint_overlap(bitmap, rows):
+    """返回重叠部分的行染成浅绿色的新图像，查找表只作用于这些行"""
+    if bitmap.mode in OVERLAP_TINT_LUTS:
+        bitmap = bitmap.copy()
+    else:
+        has_alpha = 'A' in bitmap.getbands() or 'transparency' in bitmap.info
+        bitmap = bitmap.convert('RGBA' if has_alpha else 'RGB')
+    lut = OVERLAP_TINT_LUTS[bitmap.mode]
+    for top, bottom in rows:
+        top = max(0, top)
+        bottom = min(bitmap.size[1], bottom)
+        if bottom > top:
+            box = (0, top, bitmap.size[0], bottom)
+            bitmap.paste(bitmap.crop(box).point(lut), box)
+    return bitmap
+
+# 合成模式下页码文字使用的字体，依次尝试Windows、macOS和Linux上常见的中文字体
+LABEL_FONT_CANDIDATES = (
+    'msyh.ttc', 'msyh.ttf', 'simhei.ttf', 'simsun.ttc',
+    'PingFang.ttc', 'STHeiti Light.ttc',
+    'NotoSansCJK-Regular.ttc', 'NotoSansCJKsc-Regular.otf', 'wqy-microhei.ttc', 'wqy-zenhei.ttc',
+    'DroidSansFallbackFull.ttf'
+)
+
+def load_label_font(size):
+    """加载能显示中文的字体，都找不到时返回None"""
+    for name in LABEL_FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return None
+
+def compose_page(layout, page, bitmap, font):
+    """合成模式：把边框、阴影、分隔线和页码直接画进页面图像（重叠部分的标记已在bitmap中）
+    
+    返回覆盖整个页面位置（宽page_width、高canvas_height）的图像，画布上每页只需要一个图像项目。
+    坐标与画布模式相同，只是平移到页面位置的左上角。
+    """
+    width = layout['width']
+    canvas_height = layout['canvas_height']
+    offset_x = page.index * layout['page_width']
+    x = page.x - offset_x
+    
+    tile = Image.new('RGB', (layout['page_width'], canvas_height), 'white')
+    if bitmap.mode in ('RGBA', 'LA'):
+        tile.paste(bitmap.convert('RGBA'), (x, PAGE_MARGIN), bitmap.convert('RGBA'))
+    else:
+        tile.paste(bitmap.convert('RGB'), (x, PAGE_MARGIN))
+    draw = ImageDraw.Draw(tile)
+    
+    # 边框和三边阴影
+    border_x0, border_y0, border_x1, border_y1 = page.border
+    border_x0 -= offset_x
+    border_x1 -= offset_x
+    # Tk的2像素边框以坐标为中心，PIL的边框向内画，向外扩展1像素使两者一致
+    draw.rectangle((border_x0 - 1, border_y0 - 1, border_x1 + 1, border_y1 + 1), outline='#4a90e2', width=2)
+    draw.line((border_x0 + 1, border_y0 + 1, border_x1 - 1, border_y0 + 1), fill='#2c3e50')
+    draw.line((border_x0 + 1, border_y0 + 1, border_x0 + 1, border_y1 - 1), fill='#2c3e50')
+    draw.line((border_x0 + 1, border_y1 - 1, border_x1 - 1, border_y1 - 1), fill='#2c3e50')
+    
+    for y in page.separator_ys:
+        draw.line((x, y, x + width, y), fill='red')
+    
+    # 页码和重叠比例，没有中文字体时使用英文
+    label_x, label_y = page.label_pos
+    label_x -= offset_x
+    overlap_percent = int(layout['overlap_ratio'] * 100)
+    if font is not None:
+        text = f"第 {page.index + 1}/{layout['num_pages']} 页 (重叠: {overlap_percent}%)"
+    else:
+        text = f"Page {page.index + 1}/{layout['num_pages']} (overlap: {overlap_percent}%)"
+        font = ImageFont.load_default()
+    draw.text((label_x, label_y), text, fill='#4a90e2', font=font, anchor='mm')
+    return tile
+
+def get_page_range(layout, first, last):
+    """根据画布横向滚动的可见比例(first, last)计算可见的页码范围"""
+    left = first * layout['total_width']
+    right = last * layout['total_width']
+    first_page = int(left // layout['page_width'])
+    last_page = int(right // layout['page_width'])
+    return first_page, min(last_page, layout['num_pages'] - 1)
+
+class ConfigStore:
+    """setup.ini的内存副本：启动时读取一次，修改只标记为脏，由flush()统一写回磁盘"""
+    
+    def __init__(self, path, favorites_key):
+        self.path = path
+        self.favorites_key = favorites_key
+        self.values = self.read()
+        self.dirty = False
+        
+        # 收藏列表单独解析，集合用于O(1)判断是否已收藏
+        try:
+            self.favorites = list(json.loads(self.values.get(favorites_key, '[]')))
+        except (json.JSONDecodeError, TypeError):
+            self.favorites = []
+        self.favorite_set = set(self.favorites)
+    
+    def read(self):
+        """从配置文件读取所有设置"""
+        config = {}
+        try:
+            if os.path.exists(self.path):
+                with TRACER.span('config_read', 'io'), open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if '=' in line:
+                            key, value = line.strip().split('=', 1)
+                            config[key] = value
+        except Exception as e:
+            print(f"加载配置文件出错: {e}")
+        return config
+    
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+    
+    def set(self, key, value):
+        """修改设置，值没有变化时不标记为脏"""
+        if self.values.get(key) != value:
+            self.values[key] = value
+            self.dirty = True
+    
+    def set_favorites(self, favorites):
+        """更新收藏列表"""
+        self.favorites = list(favorites)
+        self.favorite_set = set(self.favorites)
+        self.set(self.favorites_key, json.dumps(self.favorites))
+    
+    def flush(self):
+        """把修改过的设置写回配置文件"""
+        if not self.dirty:
+            return
+        text = ''.join(f"{k}={v}\n" for k, v in self.values.items())
+        with TRACER.span('config_write', 'io'):
+            atomic_write_text(self.path, text)
+        self.dirty = False
+
+class DirectoryConfigCache:
+    """各目录image_config.json的内存缓存
+    
+    每个目录的配置只读取一次，之后从内存读取；文件在磁盘上被修改时（修改时间或大小变化）重新读取。
+    修改先记录在内存中，由flush()合并写回：写回前若磁盘上的文件已被修改，先读取再覆盖本地修改过的键。
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}  # 目录 -> {'configs', 'stat', 'dirty'}
+    
+    def config_path(self, directory):
+        return os.path.join(directory, self.filename)
+    
+    def stat_file(self, directory):
+        """返回配置文件的(修改时间, 大小)，文件不存在时返回None"""
+        try:
+            stat = os.stat(self.config_path(directory))
+            return (stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
+    
+    def read_file(self, directory):
+        """读取配置文件，文件不存在或无效时返回None"""
+        try:
+            with TRACER.span('image_config_read', 'io', directory=directory), \
+                    open(self.config_path(directory), 'r', encoding='utf-8') as f:
+                configs = json.load(f)
+            return configs if isinstance(configs, dict) else None
+        except (OSError, json.JSONDecodeError):
+            return None
+    
+    def get(self, directory):
+        """获取目录的配置，配置文件不存在或无效且没有未保存的修改时返回None"""
+        entry = self.entries.get(directory)
+        stat = self.stat_file(directory)
+        if entry is None or (not entry['dirty'] and entry['stat'] != stat):
+            entry = {'configs': self.read_file(directory), 'stat': stat, 'dirty': set()}
+            self.entries[directory] = entry
+        return entry['configs']
+    
+    def update(self, directory, key, value):
+        """修改目录配置中的一项，只修改内存，需要调用flush()写回"""
+        self.get(directory)
+        entry = self.entries[directory]
+        if entry['configs'] is None:
+            entry['configs'] = {}
+        entry['configs'][key] = value
+        entry['dirty'].add(key)
+    
+    def flush(self):
+        """把所有目录中修改过的配置写回磁盘"""
+        for directory, entry in self.entries.items():
+            if not entry['dirty']:
+                continue
+            try:
+                configs = entry['configs']
+                # 磁盘上的文件在此期间被其他程序修改过，以磁盘内容为基础合并本地修改
+                if self.stat_file(directory) != entry['stat']:
+                    merged = self.read_file(directory) or {}
+                    for key in entry['dirty']:
+                        merged[key] = configs[key]
+                    configs = merged
+                
+                with TRACER.span('image_config_write', 'io', directory=directory):
+                    atomic_write_text(
+                        self.config_path(directory),
+                        json.dumps(configs, indent=4, ensure_ascii=False)
+                    )
+                entry['configs'] = configs
+                entry['stat'] = self.stat_file(directory)
+                entry['dirty'] = set()
+            except Exception as e:
+                print(f"无法保存配置文件: {e}")
+
+class TiledImageStore:
+    """超大图像的磁盘缓存：逐级减半的多级原始像素，按行存放，通过mmap读取
+    
+    文件开头是固定长度的JSON头，之后依次是各级的像素数据。显示时只读取与页面相交的行，
+    常驻内存只与视口大小有关，与图像大小无关。
+    """
+    
+    HEADER_SIZE = 4096
+    VERSION = 1
+    SUFFIX = '.tiles'
+    MIN_LEVEL_WIDTH = 256  # 宽度小于此值后不再生成更小的级别
+    BAND_HEIGHT = 512      # 转换时每次处理的行数（偶数，便于逐级减半）
+    
+    # 转换时需要临时解除Pillow的解压炸弹限制
+    pixel_limit_lock = threading.Lock()
+    
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.file = open(cache_path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            header = json.loads(self.mm[:self.HEADER_SIZE].rstrip(b'\0').decode('utf-8'))
+            if header.get('version') != self.VERSION:
+                raise ValueError("cache version mismatch")
+        except Exception:
+            self.file.close()
+            raise
+        self.mode = header['mode']
+        self.size = tuple(header['size'])
+        self.levels = header['levels']  # [{'width', 'height', 'offset'}, ...]
+        self.bands = Image.getmodebands(self.mode)
+    
+    @staticmethod
+    def cache_path_for(cache_dir, file_key):
+        """根据文件键（路径、修改时间、大小）生成缓存文件路径，文件被修改后自动使用新的缓存"""
+        digest = hashlib.sha1(repr(file_key).encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir, 'tiles', digest + TiledImageStore.SUFFIX)
+    
+    @classmethod
+    def open(cls, cache_path):
+        """打开已存在的缓存文件，不存在或无效时返回None"""
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            tiles = cls(cache_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            # 更新修改时间作为最近使用时间
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return tiles
+    
+    @classmethod
+    def trim(cls, cache_dir, max_bytes):
+        """按最近使用时间淘汰缓存文件，使总大小不超过预算，最近使用的文件总是保留
+        
+        一个文件就有数GB，文件数很少，每次建立缓存后直接扫描目录即可。
+        """
+        directory = os.path.join(cache_dir, 'tiles')
+        files = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.endswith(cls.SUFFIX):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, entry.path, stat.st_size))
+        except OSError:
+            return
+        files.sort()
+        total_bytes = sum(size for _, _, size in files)
+        for _, path, size in files[:-1]:
+            if total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue  # Windows下正在显示的文件无法删除
+            total_bytes -= size
+    
+    @classmethod
+    def build(cls, source_path, cache_path):
+        """把图像转换为分级缓存文件
+        
+        Pillow无法只解码部分行，原图需要完整解码一次；解码的目标是映射到临时文件的缓冲区，
+        由操作系统按需换入换出，不占用整幅图像的内存。第0级从中按行带转换模式后写入，
+        之后的每一级都从缓存文件中按行带读取上一级并缩小。
+        """
+        directory = os.path.dirname(cache_path)
+        os.makedirs(directory, exist_ok=True)
+        image = open_unlimited_image(source_path)
+        
+        # 统一转换为可以按像素平均的模式
+        mode = image.mode
+        if mode not in ('L', 'RGB', 'RGBA'):
+            has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+            mode = 'RGBA' if has_alpha else ('L' if mode in ('1', 'I', 'I;16', 'F') else 'RGB')
+        bands = Image.getmodebands(mode)
+        
+        # 计算各级尺寸和在文件中的位置
+        levels = []
+        width, height = image.size
+        offset = cls.HEADER_SIZE
+        while True:
+            levels.append({'width': width, 'height': height, 'offset': offset})
+            offset += width * height * bands
+            if width < cls.MIN_LEVEL_WIDTH * 2:
+                break
+            width, height = (width + 1) // 2, (height + 1) // 2
+        
+        header = json.dumps({
+            'version': cls.VERSION,
+            'mode': mode,
+            'size': image.size,
+            'levels': levels
+        }).encode('utf-8')
+        
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w+b') as f, image, tempfile.TemporaryFile(prefix='.tmp-', dir=directory) as scratch:
+                decode_buffer = cls.map_decode_buffer(image, scratch)
+                try:
+                    image.load()
+                    f.truncate(offset)
+                    with mmap.mmap(f.fileno(), offset) as mm:
+                        mm[:len(header)] = header
+                        
+                        # 第0级从解码后的图像分行带转换模式后写入
+                        level = levels[0]
+                        stride = level['width'] * bands
+                        for y in range(0, level['height'], cls.BAND_HEIGHT):
+                            band = image.crop((0, y, level['width'], min(y + cls.BAND_HEIGHT, level['height'])))
+                            if band.mode != mode:
+                                band = band.convert(mode)
+                            start = level['offset'] + y * stride
+                            data = band.tobytes()
+                            mm[start:start + len(data)] = data
+                        
+                        # 之后的每一级从文件中读取上一级的行带并缩小一半
+                        for previous, level in zip(levels, levels[1:]):
+                            source_stride = previous['width'] * bands
+                            stride = level['width'] * bands
+                            for y in range(0, previous['height'], cls.BAND_HEIGHT):
+                                rows = min(cls.BAND_HEIGHT, previous['height'] - y)
+                                start = previous['offset'] + y * source_stride
+                                band = Image.frombytes(mode, (previous['width'], rows),
+                                                       mm[start:start + rows * source_stride])
+                                data = band.reduce(2).tobytes()
+                                target = level['offset'] + (y // 2) * stride
+                                mm[target:target + len(data)] = data
+                        mm.flush()
+                finally:
+                    # 先释放引用缓冲区的图像，才能关闭映射
+                    image.close()
+                    if decode_buffer is not None:
+                        decode_buffer.close()
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return cls(cache_path)
+    
+    @staticmethod
+    def map_decode_buffer(image, scratch):
+        """让尚未解码的图像解码到映射到临时文件的缓冲区中，返回映射；模式不支持时返回None，照常在内存中解码
+        
+        ImageFile.load()在已有尺寸和模式相同的图像内存时直接解码到其中。
+        """
+        width, height = image.size
+        if image.mode in ('1', 'L', 'P'):
+            pixel_bytes = 1
+        elif image.mode.startswith('I;16'):
+            pixel_bytes = 2
+        else:
+            pixel_bytes = 4
+        scratch.truncate(width * height * pixel_bytes)
+        buffer = mmap.mmap(scratch.fileno(), width * height * pixel_bytes)
+        try:
+            image.im = Image.core.map_buffer(buffer, image.size, 'raw', 0, (image.mode, width * pixel_bytes, 1))
+        except (ValueError, TypeError):
+            buffer.close()
+            return None
+        return buffer
+    
+    def read_region(self, size, box, resample=None):
+        """生成缩放到size后的图像中box区域，只读取与该区域相交的行，默认使用LANCZOS"""
+        if resample is None:
+            resample = Image.Resampling.LANCZOS
+        target_width, target_height = size
+        
+        # 选择尺寸不小于目标尺寸的最小级别
+        level = self.levels[0]
+        for candidate in self.levels[1:]:
+            if candidate['width'] < target_width or candidate['height'] < target_height:
+                break
+            level = candidate
+        
+        # 把目标区域换算到该级别的坐标，多读几行作为重采样滤镜的边界
+        ratio_x = level['width'] / target_width
+        ratio_y = level['height'] / target_height
+        left, top, right, bottom = box
+        margin = 3 if resample != Image.Resampling.NEAREST else 0
+        y0 = max(0, int(math.floor(top * ratio_y)) - margin)
+        y1 = min(level['height'], int(math.ceil(bottom * ratio_y)) + margin)
+        
+        stride = level['width'] * self.bands
+        start = level['offset'] + y0 * stride
+        band = Image.frombytes(self.mode, (level['width'], y1 - y0), self.mm[start:start + (y1 - y0) * stride])
+        source_box = (left * ratio_x, top * ratio_y - y0, right * ratio_x, bottom * ratio_y - y0)
+        return band.resize((right - left, bottom - top), resample, box=source_box)
+    
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+class PageDiskCache:
+    """渲染完成的页面的磁盘缓存，下次打开同一份乐谱时直接读取，不必解码和缩放
+    
+    键为(路径, 修改时间, 文件大小, 缩放比例, 画布高度, 重叠比例, 页码)，文件被修改后自动失效。
+    页面以未压缩的原始像素保存，读取时不需要解码；总大小超出预算时按最近使用时间淘汰。
+    """
+    
+    MAGIC = b'PGC1'
+    HEADER = struct.Struct('<4s8sII')  # 标识, 模式, 宽, 高
+    SUFFIX = '.page'
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index = None  # 文件名 -> 字节数，按最近使用时间排列，首次写入时才扫描目录
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def make_name(cls, key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + cls.SUFFIX
+    
+    def path_for(self, key):
+        return os.path.join(self.directory, self.make_name(key))
+    
+    def __contains__(self, key):
+        # 直接检查文件，预渲染进程写入的页面同样可见
+        return os.path.exists(self.path_for(key))
+    
+    def has_pages(self, key_prefix, num_pages):
+        """判断一份乐谱在某种布局下的所有页面是否都已缓存"""
+        return all(key_prefix + (i,) in self for i in range(num_pages))
+    
+    def load_index(self):
+        """扫描缓存目录，按修改时间（即最近使用时间）建立索引"""
+        files = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(self.SUFFIX):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, entry.name, stat.st_size))
+        except OSError:
+            pass
+        files.sort()
+        self.index = OrderedDict((name, size) for _, name, size in files)
+        self.total_bytes = sum(self.index.values())
+    
+    def get(self, key):
+        """读取缓存的页面，未命中时返回None"""
+        name = self.make_name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, mode, width, height = self.HEADER.unpack_from(data)
+            if magic != self.MAGIC:
+                return None
+            image = Image.frombytes(mode.rstrip(b'\0').decode('ascii'), (width, height),
+                                    data[self.HEADER.size:])
+            # 更新修改时间作为最近使用时间
+            os.utime(path)
+        except (OSError, ValueError, struct.error):
+            return None
+        with self.lock:
+            if self.index is not None and name in self.index:
+                self.index.move_to_end(name)
+        return image
+    
+    def put(self, key, image):
+        """写入页面，并淘汰最久未使用的页面"""
+        if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        name = self.make_name(key)
+        data = self.HEADER.pack(self.MAGIC, image.mode.encode('ascii'), *image.size) + image.tobytes()
+        if len(data) > self.max_bytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        except OSError as e:
+            print(f"写入页面缓存出错: {e}")
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except OSError as e:
+            print(f"写入页面缓存出错: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        with self.lock:
+            if self.index is None:
+                self.load_index()
+            else:
+                self.total_bytes -= self.index.pop(name, 0)
+                self.index[name] = len(data)
+                self.total_bytes += len(data)
+            self.trim_locked()
+    
+    def trim(self):
+        """按预算淘汰页面，预渲染结束后调用"""
+        with self.lock:
+            self.load_index()
+            self.trim_locked()
+    
+    def trim_locked(self):
+        while self.total_bytes > self.max_bytes and self.index:
+            name, size = self.index.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+class ThumbnailCache:
+    """缩略图的磁盘缓存，以(路径, 修改时间, 文件大小, 缩略图尺寸)为键，文件被修改后自动失效"""
+    
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+    
+    def path_for(self, file_key):
+        digest = hashlib.sha1(repr(file_key + (self.size,)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.png')
+    
+    def get(self, file_key):
+        """读取缓存的缩略图，未命中时返回None"""
+        try:
+            with Image.open(self.path_for(file_key)) as image:
+                image.load()
+            return image
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def render(source_path, cache_path, size):
+        """缩略图进程：生成缩略图并写入缓存，返回(模式, 尺寸, 像素数据)
+        
+        JPEG通过draft()直接以1/2到1/8的分辨率解码，其他格式解码后用thumbnail()缩小。
+        """
+        with Image.open(source_path) as image:
+            image.draft('RGB', (size, size))
+            image.thumbnail((size, size), Image.Resampling.BILINEAR)
+            if image.mode not in ('L', 'RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        
+        directory = os.path.dirname(cache_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.png', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'PNG', compress_level=1)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return image.mode, image.size, image.tobytes()
+
+class SearchIndex:
+    """文件名搜索索引：把搜索范围内的所有图片记录在SQLite数据库中
+    
+    文件名用FTS5的trigram分词建立全文索引，可以查找文件名中的任意子串；SQLite不支持FTS5时退回LIKE查找。
+    按目录的修改时间增量更新：目录的修改时间不变时其中的条目没有增删，只需继续检查子目录。
+    """
+    
+    COMMIT_INTERVAL = 200  # 每更新多少个目录提交一次，搜索可以看到更新的进度
+    
+    def __init__(self, db_path, image_extensions):
+        self.db_path = db_path
+        self.image_extensions = image_extensions
+        self.local = threading.local()  # SQLite连接不能跨线程使用，每个线程一个连接
+        
+        conn = self.connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime REAL);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, dir TEXT, name TEXT);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+        """)
+        try:
+            conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+                    name, content='files', content_rowid='id', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+                    INSERT INTO files_fts (rowid, name) VALUES (new.id, new.name);
+                END;
+                CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+                    INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                END;
+            """)
+            self.has_fts = True
+        except sqlite3.OperationalError as e:
+            print(f"SQLite不支持FTS5 trigram分词，搜索将使用LIKE: {e}")
+            self.has_fts = False
+        conn.commit()
+    
+    def connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA journal_mode=WAL")  # 更新索引时仍可以搜索
+            self.local.conn = conn
+        return conn
+    
+    @staticmethod
+    def normalize(path):
+        return os.path.normpath(os.path.abspath(path))
+    
+    def update(self, roots):
+        """后台线程：按搜索范围增量更新索引，移除已不在范围内的目录"""
+        conn = self.connect()
+        roots = [self.normalize(root) for root in roots]
+        for (path,) in conn.execute("SELECT path FROM dirs WHERE parent IS NULL").fetchall():
+            if path not in roots:
+                self.remove_tree(conn, path)
+        for root in roots:
+            self.update_tree(conn, root, None)
+        conn.commit()
+    
+    def update_directory(self, path):
+        """后台线程：已索引的目录发生变化时只更新该目录及其新增的子目录"""
+        conn = self.connect()
+        path = self.normalize(path)
+        row = conn.execute("SELECT parent FROM dirs WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            self.update_tree(conn, path, row[0], force=True)
+            conn.commit()
+    
+    def update_tree(self, conn, root, parent, force=False):
+        """更新目录树，修改时间没有变化的目录不重新列出"""
+        stack = [(root, parent)]
+        updated = 0
+        while stack:
+            path, parent = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                self.remove_tree(conn, path)
+                continue
+            
+            row = conn.execute("SELECT mtime FROM dirs WHERE path = ?", (path,)).fetchone()
+            if row is not None and row[0] == mtime and not (force and path == root):
+                children = [r[0] for r in conn.execute("SELECT path FROM dirs WHERE parent = ?", (path,))]
+            else:
+                children = self.index_directory(conn, path, parent, mtime)
+                updated += 1
+                if updated % self.COMMIT_INTERVAL == 0:
+                    conn.commit()
+            stack.extend((child, path) for child in children)
+    
+    def index_directory(self, conn, path, parent, mtime):
+        """重新列出一个目录，增删其中的文件记录，返回子目录列表"""
+        names = set()
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(self.image_extensions):
+                            names.add(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        
+        indexed = {r[0] for r in conn.execute("SELECT name FROM files WHERE dir = ?", (path,))}
+        conn.executemany("DELETE FROM files WHERE path = ?",
+                         [(os.path.join(path, name),) for name in indexed - names])
+        conn.executemany("INSERT INTO files (path, dir, name) VALUES (?, ?, ?)",
+                         [(os.path.join(path, name), path, name) for name in names - indexed])
+        
+        # 已删除的子目录连同其中的文件一起移除
+        known = {r[0] for r in conn.execute("SELECT path FROM dirs WHERE parent = ?", (path,))}
+        for removed in known - set(subdirs):
+            self.remove_tree(conn, removed)
+        conn.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)",
+                     (path, parent, mtime))
+        return subdirs
+    
+    @staticmethod
+    def remove_tree(conn, path):
+        """移除目录及其所有子目录的记录"""
+        prefix = os.path.join(path, '')
+        conn.execute("DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?", (path, len(prefix), prefix))
+        conn.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+    
+    def search(self, query, limit=100):
+        """按文件名查找，空格分隔的每个词都要出现在文件名中，返回按相关度排序的路径列表
+        
+        trigram索引只能查找至少3个字符的词，更短的词用LIKE在结果中筛选。
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        long_terms = [t for t in terms if len(t) >= 3] if self.has_fts else []
+        short_terms = [t for t in terms if t not in long_terms]
+        
+        if long_terms:
+            sql = ("SELECT f.path FROM files_fts JOIN files f ON f.id = files_fts.rowid "
+                   "WHERE files_fts MATCH ?")
+            params = [' AND '.join('"' + t.replace('"', '""') + '"' for t in long_terms)]
+            order = " ORDER BY bm25(files_fts), length(f.name), f.name"
+        else:
+            sql = "SELECT f.path FROM files f WHERE 1"
+            params = []
+            order = " ORDER BY length(f.name), f.name"
+        for term in short_terms:
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            sql += " AND f.name LIKE ? ESCAPE '\\'"
+            params.append(f"%{escaped}%")
+        
+        rows = self.connect().execute(sql + order + " LIMIT ?", params + [limit])
+        return [row[0] for row in rows]
+
+class DirectoryListingCache:
+    """目录列表缓存：保存每个目录中子目录和图片文件的状态信息
+    
+    改变排序方式时只重新排序缓存的条目，不访问文件系统；文件系统监视器通过update_names()增量更新。
+    """
+    
+    def __init__(self, image_extensions):
+        self.image_extensions = image_extensions
+        self.listings = {}  # 目录 -> {'entries': {名称: 条目}, 'dir_mtime', 'dir_times'}
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def get_dir_mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+    
+    @staticmethod
+    def make_entry(path, name, is_dir, mtime):
+        """生成目录树使用的条目信息"""
+        info = {
+            'name': name,
+            'path': os.path.join(path, name),
+            'is_dir': is_dir,
+            'mtime': mtime
+        }
+        if is_dir:
+            info['text'] = name
+        else:
+            # 将时间戳转换为日期字符串，只显示年月日
+            mtime_str = time.strftime("%Y-%m-%d", time.localtime(mtime))
+            # 在文件名后添加修改日期
+            info['text'] = f"{name} ({mtime_str})"
+        return info
+    
+    def scan(self, path, dir_times):
+        """用os.scandir列出目录并放入缓存，dir_times为False时不读取子目录的修改时间"""
+        dir_mtime = self.get_dir_mtime(path)
+        entries = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                        if not is_dir and not entry.name.lower().endswith(self.image_extensions):
+                            continue
+                        # 子目录只在按时间排序时才需要修改时间
+                        mtime = entry.stat().st_mtime if dir_times or not is_dir else 0
+                    except OSError:
+                        continue
+                    entries[entry.name] = self.make_entry(path, entry.name, is_dir, mtime)
+        except OSError:
+            pass
+        
+        with self.lock:
+            self.listings[path] = {'entries': entries, 'dir_mtime': dir_mtime, 'dir_times': dir_times}
+        return list(entries.values())
+    
+    def rescan(self, path):
+        """重新扫描已缓存的目录"""
+        with self.lock:
+            listing = self.listings.get(path)
+        return self.scan(path, listing['dir_times'] if listing else False)
+    
+    def get(self, path, dir_times, validate=True):
+        """获取缓存的条目，没有缓存或已失效时返回None
+        
+        validate为True时比较目录的修改时间，增删、重命名条目后目录的修改时间会变化。
+        """
+        with self.lock:
+            listing = self.listings.get(path)
+        if listing is None or (dir_times and not listing['dir_times']):
+            return None
+        if validate and self.get_dir_mtime(path) != listing['dir_mtime']:
+            return None
+        return list(listing['entries'].values())
+    
+    def update_names(self, path, names):
+        """重新读取目录中指定名称的条目，不存在的条目从缓存中删除；目录没有缓存时返回False"""
+        with self.lock:
+            listing = self.listings.get(path)
+        if listing is None:
+            return False
+        
+        updates = {}
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(path, name))
+                is_dir = os.path.isdir(os.path.join(path, name))
+                if is_dir or name.lower().endswith(self.image_extensions):
+                    mtime = stat.st_mtime if listing['dir_times'] or not is_dir else 0
+                    updates[name] = self.make_entry(path, name, is_dir, mtime)
+                    continue
+            except OSError:
+                pass
+            updates[name] = None
+        
+        with self.lock:
+            for name, info in updates.items():
+                if info:
+                    old = listing['entries'].get(name)
+                    if old and 'has_children' in old:
+                        info['has_children'] = old['has_children']
+                    listing['entries'][name] = info
+                else:
+                    listing['entries'].pop(name, None)
+            listing['dir_mtime'] = self.get_dir_mtime(path)
+        return True
+    
+    def invalidate(self, path):
+        with self.lock:
+            self.listings.pop(path, None)
+
+class DirectoryWatcher:
+    """监视已展开目录的变化，变化时在监视线程中调用callback(目录, 名称集合)
+    
+    Linux上使用inotify，名称集合为发生变化的条目；其他系统或inotify不可用时定时比较目录的修改时间，
+    名称集合为None，表示需要重新扫描整个目录。
+    """
+    
+    # inotify事件掩码
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ONLYDIR = 0x01000000
+    WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_ONLYDIR)
+    EVENT_HEADER = struct.Struct('iIII')
+    
+    def __init__(self, callback, poll_interval=2.0, settle_time=0.2):
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time  # 合并一批连续事件的等待时间
+        self.lock = threading.Lock()
+        self.watches = {}  # 目录 -> {'count', 'wd', 'mtime'}
+        self.paths_by_wd = {}
+        self.stopped = threading.Event()
+        
+        self.libc = None
+        self.inotify_fd = -1
+        if sys.platform.startswith('linux'):
+            try:
+                self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                self.inotify_fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            except (OSError, AttributeError):
+                self.inotify_fd = -1
+        
+        target = self.run_inotify if self.inotify_fd >= 0 else self.run_polling
+        threading.Thread(target=target, name='watcher', daemon=True).start()
+    
+    def is_live(self, path):
+        """目录是否正在被inotify监视（缓存可以直接信任，不必检查修改时间）"""
+        with self.lock:
+            watch = self.watches.get(path)
+            return bool(watch and watch['wd'] >= 0)
+    
+    def watch(self, path):
+        """开始监视目录，同一目录可以多次监视，需要相同次数的unwatch"""
+        with self.lock:
+            watch = self.watches.get(path)
+            if watch:
+                watch['count'] += 1
+                return
+            wd = -1
+            if self.inotify_fd >= 0:
+                wd = self.libc.inotify_add_watch(
+                    self.inotify_fd, os.fsencode(path), self.WATCH_MASK
+                )
+                if wd >= 0:
+                    self.paths_by_wd[wd] = path
+            self.watches[path] = {
+                'count': 1,
+                'wd': wd,
+                'mtime': DirectoryListingCache.get_dir_mtime(path)
+            }
+    
+    def unwatch(self, path):
+        with self.lock:
+            watch = self.watches.get(path)
+            if not watch:
+                return
+            watch['count'] -= 1
+            if watch['count'] > 0:
+                return
+            del self.watches[path]
+            if watch['wd'] >= 0:
+                self.paths_by_wd.pop(watch['wd'], None)
+                self.libc.inotify_rm_watch(self.inotify_fd, watch['wd'])
+    
+    def stop(self):
+        self.stopped.set()
+    
+    def run_inotify(self):
+        """监视线程：读取inotify事件，按目录合并后回调"""
+        while not self.stopped.is_set():
+            readable, _, _ = select.select([self.inotify_fd], [], [], 0.5)
+            if not readable:
+                continue
+            
+            # 等待一小段时间，把同一批操作产生的事件合并处理
+            time.sleep(self.settle_time)
+            changes = {}
+            overflow = False
+            while True:
+                try:
+                    data = os.read(self.inotify_fd, 65536)
+                except BlockingIOError:
+                    break
+                offset = 0
+                while offset + self.EVENT_HEADER.size <= len(data):
+                    wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                    offset += self.EVENT_HEADER.size
+                    name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                    offset += length
+                    if mask & self.IN_Q_OVERFLOW:
+                        overflow = True
+                        continue
+                    with self.lock:
+                        path = self.paths_by_wd.get(wd)
+                    if path and name:
+                        changes.setdefault(path, set()).add(name)
+            
+            if overflow:
+                # 事件队列溢出时无法知道具体变化，重新扫描所有监视的目录
+                with self.lock:
+                    changes = {path: None for path in self.watches}
+            for path, names in changes.items():
+                self.callback(path, names)
+        os.close(self.inotify_fd)
+    
+    def run_polling(self):
+        """监视线程：定时比较目录的修改时间"""
+        while not self.stopped.wait(self.poll_interval):
+            with self.lock:
+                watches = list(self.watches.items())
+            for path, watch in watches:
+                mtime = DirectoryListingCache.get_dir_mtime(path)
+                if mtime != watch['mtime']:
+                    watch['mtime'] = mtime
+                    self.callback(path, None)
 
 class ImageViewer:
     def __init__(self, root):
         self.root = root
         self.root.title("乐谱/长图浏览器")
         
-        # 设置全屏
-        self.root.state('zoomed')
+        # 设置全屏，X11不支持'zoomed'状态时改用-zoomed属性
+        try:
+            self.root.state('zoomed')
+        except tk.TclError:
+            try:
+                self.root.attributes('-zoomed', True)
+            except tk.TclError:
+                pass
         
         # 配置文件路径
         self.setup_file = "setup.ini"
+        self.config_flush_timer = None
         
         # 配置键名定义
         self.CONFIG_KEYS = {
@@ -24,9 +1654,70 @@ class ImageViewer:
             'TREE_WIDTH': 'TreeWidth',
             'MASK_STATE': 'MaskEnabled',
             'FAVORITES': 'Favorites',
-            'FAVORITES_POS': 'FavoritesManagerPos'
+            'FAVORITES_POS': 'FavoritesManagerPos',
+            'IMAGE_CACHE_MB': 'ImageCacheMB',
+            'SCALED_CACHE_MB': 'ScaledCacheMB',
+            'PAGE_CACHE_MB': 'PageCacheMB',
+            'CACHE_DIR': 'CacheDir',
+            'PAGE_DISK_CACHE_MB': 'PageDiskCacheMB',
+            'TILE_CACHE_MB': 'TileCacheMB',
+            'CANVAS_HEIGHT': 'CanvasHeight',
+            'SEARCH_ROOTS': 'SearchRoots',  # JSON列表；未设置时使用收藏夹中的目录，磁盘根目录除外
+            'COMPOSITOR': 'CompositorEnabled',
+            'TEMPO': 'Tempo',
+            'BEATS_PER_PAGE': 'BeatsPerPage',
+            'MEMORY_LIMIT_MB': 'MemoryLimitMB'
+        }
+        
+        # 支持的图片格式
+        self.IMAGE_EXTENSIONS = IMAGE_EXTENSIONS
+        
+        # 收藏夹管理器尺寸
+        self.FAVORITES_DIALOG_SIZE = {
+            'width': 500,
+            'height': 400
+        }
+        
+        # 配置参数
+        self.CONFIG = {
+            'default_tree_width': 200,
+            'min_tree_width': 100,
+            'max_favorites': 50,
+            'retry_times': 5,
+            'retry_interval': 200,
+            'overlap_min': 0.05,
+            'overlap_max': 0.3,
+            'overlap_step': 0.05,
+            'page_lookahead': 2,        # 可视区域两侧预先创建的页面数
+            'page_release_distance': 6, # 超出可视区域多少页后释放页面
+            'image_cache_mb': 512,      # 已解码图像缓存的默认内存预算
+            'scaled_cache_mb': 256,     # 缩放后图像缓存的默认内存预算
+            'page_cache_mb': 128,       # 页面裁剪图像缓存的默认内存预算
+            'memory_limit_mb': 1536,    # 所有内存中图像（缓存、显示中的图像和PhotoImage）的总预算
+            'prefetch_depth': 2,        # 向前、向后各预读的文件数
+            'config_flush_delay': 1000, # 修改设置后延迟多少毫秒写回setup.ini
+            'image_config_flush_delay': 2000, # 停止操作多少毫秒后写回image_config.json
+            'tree_insert_budget_ms': 12, # 每批向目录树插入节点的时间预算
+            'cache_dir': 'cache',       # 磁盘缓存的默认目录
+            'page_disk_cache_mb': 2048, # 页面磁盘缓存的默认容量
+            'tiled_threshold_mpx': 100, # 超过多少百万像素的图像改用磁盘分级缓存显示
+            'tile_cache_mb': 8192,      # 分级缓存的默认容量
+            'thumbnail_size': 160,      # 缩略图的最大边长
+            'thumbnail_padding': 12,    # 缩略图之间的间距
+            'search_limit': 100,        # 搜索结果的最大数量
+            'search_reindex_minutes': 10, # 每隔多少分钟检查一次搜索范围内的变化
+            'tempo': 80,                # 默认速度（每分钟拍数）
+            'tempo_min': 20,
+            'tempo_max': 300,
+            'beats_per_page': 16,       # 默认每页的拍数，自动滚动按此计算速度
+            'beats_per_page_max': 256,
+            'beats_per_measure': 4,     # 节拍器每小节的拍数，每小节第一拍重音显示
+            'scroll_frame_rate': 60     # 连续滚动的帧率
         }
         
+        # 配置只在启动时读取一次，之后都在内存中读写
+        self.config_store = ConfigStore(self.setup_file, self.CONFIG_KEYS['FAVORITES'])
+        
         # 添加遮罩控制变量，并从配置文件加载上次的状态
         self.show_mask = tk.BooleanVar()
         try:
@@ -35,20 +1726,64 @@ class ImageViewer:
         except:
             self.show_mask.set(False)
         
+        # 是否在画布上显示耗时信息
+        self.hud_enabled = tk.BooleanVar(value=False)
+        
+        # 合成模式：页面的装饰直接画进页面图像，每页只有一个画布项目
+        self.compositor_enabled = tk.BooleanVar(
+            value=self.load_config().get(self.CONFIG_KEYS['COMPOSITOR'], '0') == '1'
+        )
+        self.label_font = None  # 首次合成页面时加载
+        
+        # 演奏：节拍器和按速度自动滚动/翻页
+        config = self.load_config()
+        try:
+            self.tempo = int(config.get(self.CONFIG_KEYS['TEMPO'], self.CONFIG['tempo']))
+            self.beats_per_page = int(config.get(self.CONFIG_KEYS['BEATS_PER_PAGE'], self.CONFIG['beats_per_page']))
+        except ValueError:
+            self.tempo = self.CONFIG['tempo']
+            self.beats_per_page = self.CONFIG['beats_per_page']
+        # 手工编辑的setup.ini中可能有0或负数，限制在设置对话框允许的范围内
+        self.tempo = max(self.CONFIG['tempo_min'], min(self.CONFIG['tempo_max'], self.tempo))
+        self.beats_per_page = max(1, min(self.CONFIG['beats_per_page_max'], self.beats_per_page))
+        self.metronome_enabled = tk.BooleanVar(value=False)
+        self.performance_mode = None  # None / 'scroll' 连续滚动 / 'page' 按拍翻页
+        self.scroll_anchor = None  # (时刻, 画布x坐标)，连续滚动的位置由此按时间计算
+        self.frame_scheduler = FrameScheduler(self.root.after, self.root.after_cancel,
+                                              1 / self.CONFIG['scroll_frame_rate'], self.on_scroll_frame,
+                                              name='scroll_frame')
+        self.beat_scheduler = FrameScheduler(self.root.after, self.root.after_cancel,
+                                             60 / self.tempo, self.on_beat, name='beat')
+        
         # 创建菜单栏
         self.create_menu()
         
         # 配置文件名
         self.config_filename = "image_config.json"
         
+        # 各目录的图片配置缓存，修改后空闲一段时间再合并写回
+        self.image_configs = DirectoryConfigCache(self.config_filename)
+        self.image_config_flush_timer = None
+        
         # 创建主框架
         self.main_frame = tk.Frame(root, bg='white')
+        # 底部状态栏，显示内存占用
+        self.status_bar = tk.Label(root, anchor='w', font=('Consolas', 9), bg='#f0f0f0',
+                                   relief='sunken', borderwidth=1)
+        self.status_bar.pack(side='bottom', fill='x')
         self.main_frame.pack(fill='both', expand=True)
         
         # 左侧目录树框架
         self.tree_frame = tk.Frame(self.main_frame, bg='white')
         self.tree_frame.pack(side='left', fill='y')
         
+        # 搜索框，输入时在下方列出匹配的文件
+        self.search_var = tk.StringVar()
+        self.search_entry = ttk.Entry(self.tree_frame, textvariable=self.search_var)
+        self.search_entry.pack(side='top', fill='x', padx=2, pady=2)
+        self.search_results = tk.Listbox(self.tree_frame, height=12, activestyle='none')
+        self.search_result_paths = []
+        
         # 创建一个内部框架来包含目树
         self.inner_tree_frame = tk.Frame(self.tree_frame, bg='white')
         self.inner_tree_frame.pack(fill='both', expand=True)
@@ -90,7 +1825,7 @@ class ImageViewer:
         try:
             config = self.load_config()
             tree_width = int(config.get(self.CONFIG_KEYS['TREE_WIDTH'], '200'))
-        except (WindowsError, ValueError):
+        except ValueError:
             tree_width = 200  # 默认宽度
         
         self.tree_frame.configure(width=tree_width)
@@ -103,23 +1838,132 @@ class ImageViewer:
         # 右侧图片显示区域
         self.canvas = tk.Canvas(self.right_frame, bg='white')
         self.canvas.pack(side='top', fill='both', expand=True)
+        self.canvas.image = None  # 单张显示时的PhotoImage，保持引用
         
         # 水平滚动条
         self.scrollbar = tk.Scrollbar(self.right_frame, orient='horizontal', command=self.canvas.xview)
         self.scrollbar.pack(side='bottom', fill='x')
-        self.canvas.configure(xscrollcommand=self.scrollbar.set)
+        self.canvas.configure(xscrollcommand=self.on_canvas_xscroll)
+        
+        # 分页虚拟化：只为可视区域附近的页面创建图像和画布项目
+        self.pages = {}  # 页码 -> PhotoImage
+        self.page_layout = None
+        self.page_update_pending = False
         
         # 当前图片和缩放比例
         self.current_image = None
+        self.current_pyramid = None  # 当前图片的金字塔，缩放时使用
+        self.current_tiles = None  # 超大图像的磁盘分级缓存，使用时current_image为None
+        self.current_image_size = None  # 当前图片的原始尺寸，页面都能从缓存得到时不解码图片
         self.scale = 1.0
         self.current_directory = None  # 初始化当前目录
         
-        # 加载上次访问的目录
-        self.load_last_directory()
+        # 所有内存中图像的总预算，各缓存除了自己的预算外还共用这个上限
+        self.memory_accountant = MemoryAccountant(self.get_cache_budget('MEMORY_LIMIT_MB', 'memory_limit_mb'))
+        self.memory_update_pending = False
+        self.memory_pressure = False  # 超出总预算后只保留可见页面，降到预算的90%以下时恢复
+        self.status_timer = None
+        
+        # 已解码图像缓存，在几份乐谱之间来回切换时不必重复解码
+        self.image_cache = DecodedImageCache(self.get_cache_budget('IMAGE_CACHE_MB', 'image_cache_mb'),
+                                             self.memory_accountant, 'decoded')
+        
+        # 渲染缓存分两级，每次操作只重新计算输入发生变化的那一级：
+        # 缩放后的图像以(路径, 修改时间, 文件大小, 缩放比例)为键，预读的相邻文件也放在这里；
+        # 裁剪后的页面再加上(画布高度, 重叠比例, 页码)为键
+        self.scaled_cache = ImageLRUCache(self.get_cache_budget('SCALED_CACHE_MB', 'scaled_cache_mb'),
+                                          self.memory_accountant, 'scaled')
+        self.page_cache = ImageLRUCache(self.get_cache_budget('PAGE_CACHE_MB', 'page_cache_mb'),
+                                        self.memory_accountant, 'pages')
+        
+        # 页面的磁盘缓存，重新打开同一份乐谱时直接读取；写入在后台线程中进行
+        self.page_disk_cache = PageDiskCache(
+            os.path.join(self.get_cache_dir(), 'pages'),
+            self.get_cache_budget('PAGE_DISK_CACHE_MB', 'page_disk_cache_mb')
+        )
+        self.page_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='page-writer')
+        # 调整缩放比例或重叠比例后，停止操作一段时间才写入页面，中间经过的比例不写入磁盘
+        self.page_store_timer = None
+        
+        # 在后台线程中列出目录，结果分批插入目录树
+        self.populate_jobs = {}  # 节点 -> 填充任务
+        self.path_index = {}  # 标准化路径 -> 节点
+        self.listing_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='listing')
+        
+        # 目录列表缓存，已展开的目录发生变化时由监视器增量更新
+        self.listing_cache = DirectoryListingCache(self.IMAGE_EXTENSIONS)
+        self.watcher = DirectoryWatcher(self.on_directory_changed)
+        
+        # 预读同一目录中的相邻文件
+        self.prefetch_generation = 0
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        
+        # 渐进式渲染：先显示快速预览，后台线程完成高质量缩放后逐页替换
+        self.page_image = None  # 高质量缩放后的图像，未完成时为None
+        self.page_image_key = None  # page_image对应的(路径, 修改时间, 文件大小, 缩放比例)
+        self.render_generation = 0  # 每次重新渲染加一，用于丢弃过期的结果
+        self.render_future = None
+        self.render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='render')
+        self.page_refine_scheduled = False
+        
+        # 超大图像在后台线程中转换为磁盘分级缓存
+        self.tile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tiles')
+        self.tile_cache_bytes = self.get_cache_budget('TILE_CACHE_MB', 'tile_cache_mb')
+        
+        # 缩略图浏览：缓存命中的缩略图在线程中读取，其余在进程池中生成
+        self.thumbnail_cache = ThumbnailCache(
+            os.path.join(self.get_cache_dir(), 'thumbs'), self.CONFIG['thumbnail_size']
+        )
+        # 进程池在界面线程中创建，子进程在首次提交任务时才启动
+        self.thumbnail_pool = make_process_pool()
+        self.thumbnail_grid = None
+        self.thumbnail_generation = 0
+        
+        # 文件名搜索索引，在后台线程中增量更新
+        self.search_index = SearchIndex(os.path.join(self.get_cache_dir(), 'search.db'), self.IMAGE_EXTENSIONS)
+        self.search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search')
+        self.search_var.trace_add('write', lambda *args: self.update_search_results())
+        self.search_entry.bind('<Return>', lambda e: self.open_search_result(0))
+        self.search_entry.bind('<Down>', lambda e: self.focus_search_results())
+        self.search_entry.bind('<Escape>', lambda e: self.search_var.set(''))
+        self.search_results.bind('<ButtonRelease-1>', lambda e: self.open_search_result())
+        self.search_results.bind('<Return>', lambda e: self.open_search_result())
+        self.search_results.bind('<Escape>', lambda e: self.search_var.set(''))
+        self.schedule_search_reindex(0)
+        
+        # 性能信息：叠加在画布上的耗时显示，以及对下一次渲染的cProfile分析
+        self.hud = tk.Label(self.canvas, justify='left', anchor='nw', font=('Consolas', 9),
+                            bg='#ffffe0', fg='#333333', relief='solid', borderwidth=1)
+        self.hud_timer = None
+        self.profile_requested = False
+        self.profile_generation = None
+        self.pending_profile = None
+        
+        # 节拍指示：每拍闪烁一次，小节第一拍用红色
+        self.beat_label = tk.Label(self.canvas, width=6, font=('Consolas', 12, 'bold'),
+                                   bg='#dddddd', fg='#333333', relief='solid', borderwidth=1)
+        
+        # 后台线程不能直接操作Tk，通过队列交给界面线程执行
+        self.ui_queue = queue.Queue()
+        self.poll_ui_queue()
+        self.schedule_memory_update()
+        
+        # 窗口显示后再填充目录树并在后台恢复上次的文件
+        self.startup_marks = {}
+        self.restore_state = None
+        self.root.after_idle(self.load_last_directory)
         
         # 绑定键盘事件
         self.root.bind('<KeyPress-plus>', self.zoom_in)
         self.root.bind('<KeyPress-minus>', self.zoom_out)
+        self.root.bind('<F3>', lambda e: (self.hud_enabled.set(not self.hud_enabled.get()), self.toggle_hud()))
+        self.root.bind('<F4>', lambda e: self.request_profile())
+        self.root.bind('<F5>', lambda e: self.export_trace())
+        self.root.bind('<F6>', lambda e: self.toggle_performance('scroll'))
+        self.root.bind('<F7>', lambda e: self.toggle_performance('page'))
+        self.root.bind('<F8>', lambda e: (self.metronome_enabled.set(not self.metronome_enabled.get()),
+                                          self.toggle_metronome()))
+        self.root.bind('<Control-r>', lambda e: self.refresh_directory())
         
         # 绑定鼠标中键滚动件
         self.canvas.bind("<Button-2>", self.toggle_mask)  # 中键点击切换遮罩
@@ -139,27 +1983,6 @@ class ImageViewer:
         
         # 配置加粗标记样式
         self.tree.tag_configure('favorite', font=('TkDefaultFont', 9, 'bold'))
-        
-        # 支持的图片格式
-        self.IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-        
-        # 收藏夹管理器尺寸
-        self.FAVORITES_DIALOG_SIZE = {
-            'width': 500,
-            'height': 400
-        }
-        
-        # 配置参数
-        self.CONFIG = {
-            'default_tree_width': 200,
-            'min_tree_width': 100,
-            'max_favorites': 50,
-            'retry_times': 5,
-            'retry_interval': 200,
-            'overlap_min': 0.05,
-            'overlap_max': 0.3,
-            'overlap_step': 0.05
-        }
     
     def create_menu(self):
         """创建菜单栏"""
@@ -178,6 +2001,41 @@ class ImageViewer:
         sort_menu.add_command(label="时间顺序", command=lambda: self.sort_files("time_asc"))
         sort_menu.add_command(label="名称倒序", command=lambda: self.sort_files("name_desc"))
         sort_menu.add_command(label="名称顺序", command=lambda: self.sort_files("name_asc"))
+        sort_menu.add_separator()
+        sort_menu.add_command(label="刷新目录 (Ctrl+R)", command=self.refresh_directory)
+        
+        # 创建搜索菜单
+        search_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="搜索", menu=search_menu)
+        search_menu.add_command(label="查找文件", command=lambda: self.search_entry.focus_set())
+        search_menu.add_command(label="将当前目录加入搜索范围", command=self.add_search_root)
+        search_menu.add_command(label="从搜索范围移除当前目录", command=self.remove_search_root)
+        search_menu.add_command(label="更新搜索索引", command=lambda: self.schedule_search_reindex(0))
+        
+        # 创建性能菜单
+        perf_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="性能", menu=perf_menu)
+        perf_menu.add_checkbutton(label="显示耗时 (F3)", variable=self.hud_enabled,
+                                  command=self.toggle_hud)
+        perf_menu.add_command(label="分析下一次渲染 (F4)", command=self.request_profile)
+        perf_menu.add_command(label="导出性能跟踪 (F5)", command=self.export_trace)
+        perf_menu.add_separator()
+        perf_menu.add_checkbutton(label="合成页面（减少画布项目）", variable=self.compositor_enabled,
+                                  command=self.toggle_compositor)
+        
+        # 创建演奏菜单
+        play_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="演奏", menu=play_menu)
+        play_menu.add_command(label="连续滚动 (F6)", command=lambda: self.toggle_performance('scroll'))
+        play_menu.add_command(label="按拍翻页 (F7)", command=lambda: self.toggle_performance('page'))
+        play_menu.add_command(label="停止", command=self.stop_performance)
+        play_menu.add_separator()
+        play_menu.add_checkbutton(label="节拍器 (F8)", variable=self.metronome_enabled,
+                                  command=self.toggle_metronome)
+        play_menu.add_command(label="设置速度...", command=self.show_tempo_settings)
+        
+        # 添加缩略图浏览
+        menubar.add_command(label="缩略图", command=self.show_thumbnail_grid)
         
         # 添加遮罩选项
         menubar.add_checkbutton(label="遮罩", variable=self.show_mask, 
@@ -189,6 +2047,20 @@ class ImageViewer:
         # 更新收藏夹菜单
         self.update_favorites_menu()
     
+    def get_cache_budget(self, config_key, default_key):
+        """从配置文件读取缓存的内存预算（MB），返回字节数"""
+        try:
+            config = self.load_config()
+            cache_mb = int(config.get(self.CONFIG_KEYS[config_key], self.CONFIG[default_key]))
+        except ValueError:
+            cache_mb = self.CONFIG[default_key]
+        return cache_mb * 1024 * 1024
+    
+    def get_cache_dir(self):
+        """获取磁盘缓存目录"""
+        cache_dir = self.load_config().get(self.CONFIG_KEYS['CACHE_DIR'], '') or self.CONFIG['cache_dir']
+        return os.path.abspath(cache_dir)
+    
     def show_timed_message(self, message, seconds=3):
         """显示定时消息对话框"""
         dialog = tk.Toplevel(self.root)
@@ -199,40 +2071,30 @@ class ImageViewer:
         label = tk.Label(dialog, text=message, pady=20)
         label.pack()
         
-        def close_dialog():
-            time.sleep(seconds)
-            dialog.destroy()
-        
-        # 启动定时器线程
-        threading.Thread(target=close_dialog, daemon=True).start()
+        # 由Tk的定时器关闭，不能在其他线程中操作窗口
+        dialog.after(int(seconds * 1000), dialog.destroy)
     
     def load_config(self):
-        """从配置文件加载设置"""
-        config = {}
-        try:
-            if os.path.exists(self.setup_file):
-                with open(self.setup_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if '=' in line:
-                            key, value = line.strip().split('=', 1)
-                            config[key] = value
-        except Exception as e:
-            print(f"加载配置文件出错: {e}")
-        return config
+        """获取设置（内存中的副本，不读取磁盘）"""
+        return self.config_store.values
     
     def save_config(self, key, value):
-        """保存设置到配置文件"""
+        """保存设置，合并一段时间内的修改后再写回配置文件"""
+        self.config_store.set(key, value)
+        if self.config_store.dirty:
+            self.schedule_config_flush()
+    
+    def schedule_config_flush(self):
+        """重新开始写回配置文件的计时，连续修改时只在最后写一次"""
+        if self.config_flush_timer:
+            self.root.after_cancel(self.config_flush_timer)
+        self.config_flush_timer = self.root.after(self.CONFIG['config_flush_delay'], self.flush_config)
+    
+    def flush_config(self):
+        """把修改过的设置写回配置文件"""
+        self.config_flush_timer = None
         try:
-            # 读取现有配置
-            config = self.load_config()
-            
-            # 更新配置
-            config[key] = value
-            
-            # 保存有配置
-            with open(self.setup_file, 'w', encoding='utf-8') as f:
-                for k, v in config.items():
-                    f.write(f"{k}={v}\n")
+            self.config_store.flush()
         except Exception as e:
             print(f"保存配置文件出错: {e}")
     
@@ -250,61 +2112,131 @@ class ImageViewer:
         except Exception as e:
             print(f"无法保存最后访问的路径: {e}")
     
+    def mark_startup(self, stage):
+        """记录从启动到某一阶段的耗时"""
+        now = time.perf_counter()
+        self.startup_marks[stage] = now - STARTUP_TIME
+        TRACER.record(f'startup_{stage}', 'startup', STARTUP_TIME, now - STARTUP_TIME)
+    
     def load_last_directory(self):
-        """从配置文件加载最后访问的文件"""
-        try:
-            config = self.load_config()
-            last_path = config.get(self.CONFIG_KEYS['LAST_FILE'], '')
-            
-            # 检查路径是否存在
-            if not os.path.exists(last_path):
-                last_path = ''
-            
-            # 首先填充根目录
-            self.populate_root()
-            
-            # 如果是文件，直接打开它
-            if os.path.isfile(last_path):
-                self.display_image(last_path)
-            
-        except Exception as e:
-            print(f"加载上次访问路径时出错: {e}")
-            self.populate_root()
+        """窗口显示后恢复上次的状态：填充目录树，同时在后台解码上次的文件，两者都完成后再显示
+        
+        解码期间画布上显示占位提示，窗口始终可以操作；期间用户已打开其他文件时不再恢复。
+        """
+        # 先完成窗口的首次绘制
+        self.root.update_idletasks()
+        self.mark_startup('first_frame')
+        last_path = self.load_config().get(self.CONFIG_KEYS['LAST_FILE'], '')
+        if not os.path.isfile(last_path):
+            last_path = None
+        self.restore_state = {'path': last_path, 'tree': False, 'image': last_path is None}
+        
+        if last_path:
+            self.canvas.create_text(
+                self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2,
+                text=f"正在打开上次的文件：{os.path.basename(last_path)}……",
+                font=('TkDefaultFont', 14), fill='#7f8c8d', tags='placeholder'
+            )
+            targets = [(last_path, self.get_saved_scale(last_path))]
+            future = self.prefetch_executor.submit(self.prefetch_files, self.prefetch_generation, None, targets)
+            future.add_done_callback(lambda f: self.run_on_ui(self.finish_restore, 'image'))
+        
+        self.populate_root(lambda: self.finish_restore('tree'))
     
-    def populate_root(self):
-        # 清空树
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+    def finish_restore(self, part):
+        """目录树或上次的文件准备好了，两者都完成后选中并显示上次的文件"""
+        state = self.restore_state
+        if state is None:
+            return
+        state[part] = True
+        self.mark_startup(part)
+        if not (state['tree'] and state['image']):
+            return
         
-        # 获取收藏列表
-        favorites = self.get_favorites()
+        self.restore_state = None
+        self.canvas.delete('placeholder')
+        if state['path'] and not hasattr(self, 'current_file_path'):
+            self.open_file_in_tree(state['path'], self.report_startup)
+        else:
+            self.report_startup()
+    
+    def report_startup(self):
+        """在控制台输出启动各阶段的耗时（从进程启动算起）"""
+        self.mark_startup('restored')
+        print("启动耗时: " + ", ".join(f"{stage} {seconds * 1000:.0f} ms"
+                                   for stage, seconds in self.startup_marks.items()))
+    
+    def populate_root(self, callback=None):
+        """填充目录树的根节点，Windows下在后台线程中读取驱动器卷标，完成后调用callback"""
+        # 清空树
+        self.delete_tree_children('')
         
         # 添加驱动器
         if os.name == 'nt':  # Windows
-            import win32api
-            drives = win32api.GetLogicalDriveStrings().split('\000')[:-1]
-            for drive in drives:
-                try:
-                    # 获取驱动器卷标
-                    volume_name = win32api.GetVolumeInformation(drive)[0]
-                    drive_text = f"{drive} ({volume_name})" if volume_name else drive
-                    drive_node = self.tree.insert('', 'end', text=drive_text, values=(drive,))
-                    # 如果是收藏的项目，添加加粗标记
-                    if drive in favorites:
-                        self.tree.item(drive_node, tags=('favorite',))
-                    self.tree.insert(drive_node, 'end', text='')
-                except:
-                    # 如果无法获取卷标信息，仅显示盘符
-                    drive_node = self.tree.insert('', 'end', text=drive, values=(drive,))
-                    # 如果是收藏的项目，添加加粗标记
-                    if drive in favorites:
-                        self.tree.item(drive_node, tags=('favorite',))
-                    self.tree.insert(drive_node, 'end', text='')
+            def list_drives():
+                # 读取光驱、网络驱动器的卷标可能很慢，不在界面线程中进行
+                import win32api
+                drives = []
+                for drive in win32api.GetLogicalDriveStrings().split('\000')[:-1]:
+                    try:
+                        # 获取驱动器卷标
+                        volume_name = win32api.GetVolumeInformation(drive)[0]
+                        drives.append((drive, f"{drive} ({volume_name})" if volume_name else drive))
+                    except Exception:
+                        # 如果无法获取卷标信息，仅显示盘符
+                        drives.append((drive, drive))
+                return drives
+            
+            future = self.listing_executor.submit(list_drives)
+            future.add_done_callback(lambda f: self.run_on_ui(self.insert_root_items, f, callback))
         else:  # Unix/Linux/Mac
-            root_node = self.tree.insert('', 'end', text='/', values=('/'))
-            if '/' in favorites:
-                self.tree.item(root_node, tags=('favorite',))
+            root_node = self.insert_tree_item('', '/', '/')
             self.tree.insert(root_node, 'end', text='')
+            if callback:
+                callback()
+    
+    def insert_root_items(self, future, callback):
+        """界面线程：插入后台读取的驱动器"""
+        try:
+            drives = future.result()
+        except Exception as e:
+            print(f"无法列出驱动器: {e}")
+            drives = []
+        for drive, drive_text in drives:
+            drive_node = self.insert_tree_item('', drive, drive_text)
+            self.tree.insert(drive_node, 'end', text='')
+        if callback:
+            callback()
+    
+    @staticmethod
+    def path_key(path):
+        """路径索引使用的键：标准化路径，Windows上不区分大小写"""
+        return os.path.normcase(os.path.normpath(path))
+    
+    def insert_tree_item(self, parent, path, text, index='end'):
+        """插入代表路径的节点，收藏的项目加粗显示，并记录到路径索引中"""
+        item = self.tree.insert(parent, index, text=text, values=(path,))
+        if path in self.config_store.favorite_set:
+            self.tree.item(item, tags=('favorite',))
+        self.path_index[self.path_key(path)] = item
+        return item
+    
+    def delete_tree_item(self, item):
+        """删除节点及其子节点，同时更新路径索引并停止监视其中已展开的目录"""
+        self.delete_tree_children(item)
+        values = self.tree.item(item)['values']
+        if values:
+            key = self.path_key(str(values[0]))
+            if self.path_index.get(key) == item:
+                del self.path_index[key]
+        self.tree.delete(item)
+    
+    def find_tree_item(self, path):
+        """通过路径索引查找节点，找不到时返回None"""
+        item = self.path_index.get(self.path_key(path))
+        if item and self.tree.exists(item):
+            return item
+        return None
     
     def on_tree_open(self, event):
         node = self.tree.focus()
@@ -317,128 +2249,273 @@ class ImageViewer:
                 self.tree.delete(children[0])
                 self.populate_node(node)
     
-    def populate_node(self, node):
+    def populate_node(self, node, callback=None):
+        """在后台线程中列出目录，再分批插入到目录树中，全部插入后调用callback"""
         path = self.tree.item(node)['values'][0]
-        favorites = self.get_favorites()
         
         # 获取排序方法
         sort_method = self.get_sort_method(path)
         
+        # 同一节点重新填充时，旧任务的结果会被丢弃
+        self.forget_populate_job(node)
+        job = {
+            'path': path,
+            'watching': False,
+            'entries': None,
+            'index': 0,
+            'items': {},       # 已插入的子目录路径 -> 节点
+            'empty': set(),    # 已探测为空的子目录路径
+            'callbacks': [callback] if callback else [],
+            'done': False
+        }
+        self.populate_jobs[node] = job
+        self.listing_executor.submit(self.scan_node, node, job, path, sort_method)
+    
+    def scan_node(self, node, job, path, sort_method):
+        """后台线程：获取目录列表并排序，之后逐个探测子目录是否为空"""
+        # 目录正被inotify监视时缓存总是最新的，否则用目录的修改时间检查缓存是否有效
+        time_sort = sort_method in ('time_desc', 'time_asc')
+        with TRACER.span('list_directory', 'tree', path=path):
+            entries = self.listing_cache.get(path, time_sort, validate=not self.watcher.is_live(path))
+            if entries is None:
+                entries = self.listing_cache.scan(path, time_sort)
+            entries = self.sort_listing(entries, sort_method)
+        self.run_on_ui(self.insert_directory_entries, node, job, entries)
+        self.probe_directories(entries, lambda: self.populate_jobs.get(node) is job,
+                               lambda empty: self.run_on_ui(self.mark_empty_directories, node, job, empty))
+    
+    def probe_directories(self, entries, is_current, report):
+        """后台线程：探测尚未探测过的子目录是否为空，把空目录的路径分批交给report"""
+        empty = []
+        for info in entries:
+            if not info['is_dir']:
+                break  # 子目录排在文件前面
+            if 'has_children' not in info:
+                if not is_current():
+                    return
+                info['has_children'] = self.directory_has_children(info['path'])
+            if not info['has_children']:
+                empty.append(info['path'])
+                if len(empty) >= 100:
+                    report(empty)
+                    empty = []
+        if empty:
+            report(empty)
+    
+    def sort_listing(self, entries, sort_method):
+        """排序目录条目，子目录在前，图片文件在后"""
+        dirs = [info for info in entries if info['is_dir']]
+        files = [info for info in entries if not info['is_dir']]
+        self.sort_entries(dirs, sort_method)
+        self.sort_entries(files, sort_method)
+        return dirs + files
+    
+    @staticmethod
+    def sort_entries(entries, sort_method):
+        """根据排序方法排序目录条目"""
+        if sort_method == 'time_desc':
+            entries.sort(key=lambda x: (-x['mtime'], x['name'].lower()))
+        elif sort_method == 'time_asc':
+            entries.sort(key=lambda x: (x['mtime'], x['name'].lower()))
+        elif sort_method == 'name_desc':
+            entries.sort(key=lambda x: x['name'].lower(), reverse=True)
+        else:  # name_asc
+            entries.sort(key=lambda x: x['name'].lower())
+    
+    @staticmethod
+    def directory_has_children(path):
+        """判断目录是否非空，读到第一个条目即返回"""
         try:
-            items = os.listdir(path)
-            
-            # 获取文件和目录的完整信息
-            file_info = []
-            for item in items:
-                full_path = os.path.join(path, item)
-                try:
-                    stat = os.stat(full_path)
-                    file_info.append({
-                        'name': item,
-                        'path': full_path,
-                        'is_dir': os.path.isdir(full_path),
-                        'mtime': stat.st_mtime
-                    })
-                except (OSError, PermissionError):
-                    continue
-            
-            # 根据排序方法排序
-            if sort_method == 'time_desc':
-                file_info.sort(key=lambda x: (-x['mtime'], x['name'].lower()))
-            elif sort_method == 'time_asc':
-                file_info.sort(key=lambda x: (x['mtime'], x['name'].lower()))
-            elif sort_method == 'name_desc':
-                file_info.sort(key=lambda x: x['name'].lower(), reverse=True)
-            else:  # name_asc
-                file_info.sort(key=lambda x: x['name'].lower())
-            
-            # 先添加子目录
-            for info in file_info:
+            with os.scandir(path) as it:
+                return next(it, None) is not None
+        except OSError:
+            return False
+    
+    def insert_directory_entries(self, node, job, entries=None):
+        """分批把目录条目插入到目录树中，每批不超过时间预算，其余的留到下一次after()"""
+        if self.populate_jobs.get(node) is not job or not self.tree.exists(node):
+            return
+        if entries is not None:
+            job['entries'] = entries
+        
+        entries = job['entries']
+        deadline = time.perf_counter() + self.CONFIG['tree_insert_budget_ms'] / 1000
+        with TRACER.span('tree_insert', 'tree', path=job['path']):
+            while job['index'] < len(entries):
+                info = entries[job['index']]
+                job['index'] += 1
+                
+                child = self.insert_tree_item(node, info['path'], info['text'])
                 if info['is_dir']:
-                    try:
-                        child = self.tree.insert(node, 'end', text=info['name'], values=(info['path'],))
-                        if info['path'] in favorites:
-                            self.tree.item(child, tags=('favorite',))
-                        if os.listdir(info['path']):
-                            self.tree.insert(child, 'end', text='')
-                    except PermissionError:
-                        continue
-            
-            # 再添加图片文件
-            for info in file_info:
-                if not info['is_dir'] and info['name'].lower().endswith(self.IMAGE_EXTENSIONS):
-                    # 将时间戳转换为日期字符串，只显示年月日
-                    mtime_str = time.strftime("%Y-%m-%d", time.localtime(info['mtime']))
-                    # 在文件名后添加修改日期
-                    display_name = f"{info['name']} ({mtime_str})"
-                    
-                    child = self.tree.insert(node, 'end', text=display_name, values=(info['path'],))
-                    if info['path'] in favorites:
-                        self.tree.item(child, tags=('favorite',))
-        except PermissionError:
-            pass
+                    job['items'][info['path']] = child
+                    if info['path'] not in job['empty'] and info.get('has_children', True):
+                        self.tree.insert(child, 'end', text='')
+                
+                if time.perf_counter() >= deadline:
+                    self.root.after(1, lambda: self.insert_directory_entries(node, job))
+                    return
+        
+        # 填充完成后开始监视目录的变化
+        job['done'] = True
+        if not job['watching']:
+            job['watching'] = True
+            self.watcher.watch(job['path'])
+        for callback in job['callbacks']:
+            callback()
+        job['callbacks'] = []
+    
+    def mark_empty_directories(self, node, job, paths):
+        """删除空目录的占位子节点"""
+        if self.populate_jobs.get(node) is not job:
+            return
+        for path in paths:
+            job['empty'].add(path)
+            child = job['items'].get(path)
+            if child and self.tree.exists(child):
+                children = self.tree.get_children(child)
+                if len(children) == 1 and self.tree.item(children[0])['text'] == '':
+                    self.tree.delete(children[0])
+    
+    def forget_populate_job(self, node):
+        """丢弃节点的填充任务，并停止监视对应的目录"""
+        job = self.populate_jobs.pop(node, None)
+        if job and job['watching']:
+            self.watcher.unwatch(job['path'])
+    
+    def delete_tree_children(self, node):
+        """删除节点的所有子节点，并停止监视其中已展开的目录"""
+        for item in self.tree.get_children(node):
+            self.forget_populate_job(item)
+            self.delete_tree_item(item)
+    
+    def on_directory_changed(self, path, names):
+        """监视线程：目录发生变化，在后台更新目录列表缓存和搜索索引"""
+        self.listing_executor.submit(self.update_directory_listing, path, names)
+        self.search_executor.submit(self.search_index.update_directory, path)
+    
+    def update_directory_listing(self, path, names):
+        """后台线程：增量更新目录列表缓存，names为None时重新扫描整个目录"""
+        if names is None or not self.listing_cache.update_names(path, names):
+            entries = self.listing_cache.rescan(path)
+        else:
+            entries = self.listing_cache.get(path, False, validate=False) or []
+        self.probe_directories(entries, lambda: True, lambda empty: None)
+        self.run_on_ui(self.sync_directory_nodes, path)
     
-    def expand_to_path(self, path):
-        """展开到指定路径"""
+    def sync_directory_nodes(self, path):
+        """把目录列表缓存的变化应用到显示该目录的所有已展开节点"""
+        for node, job in list(self.populate_jobs.items()):
+            if job['path'] != path or not self.tree.exists(node):
+                continue
+            if job['done']:
+                self.sync_node_children(node)
+            else:
+                job['callbacks'].append(lambda node=node: self.sync_node_children(node))
+    
+    def sync_node_children(self, node):
+        """按缓存的目录列表增删、更新和重新排列节点的子项，已有的子项及其展开状态保持不变"""
+        job = self.populate_jobs.get(node)
+        sort_method = self.get_sort_method(job['path'])
+        entries = self.listing_cache.get(job['path'], False, validate=False)
+        if entries is None:
+            return
+        entries = self.sort_listing(entries, sort_method)
+        
+        existing = {}
+        for item in self.tree.get_children(node):
+            values = self.tree.item(item)['values']
+            if values:
+                existing[str(values[0])] = item
+        
+        # 删除已经不存在的条目
+        wanted = {info['path'] for info in entries}
+        for item_path, item in existing.items():
+            if item_path not in wanted:
+                self.forget_populate_job(item)
+                self.delete_tree_item(item)
+                job['items'].pop(item_path, None)
+        
+        # 添加新条目，更新已有条目的显示文字
+        order = []
+        for info in entries:
+            item = existing.get(info['path'])
+            if item is None:
+                item = self.insert_tree_item(node, info['path'], info['text'])
+                if info['is_dir']:
+                    job['items'][info['path']] = item
+                    if info.get('has_children', True):
+                        self.tree.insert(item, 'end', text='')
+            elif self.tree.item(item, 'text') != info['text']:
+                self.tree.item(item, text=info['text'])
+            order.append(item)
+        
+        # 按排序结果重新排列子项
+        if list(self.tree.get_children(node)) != order:
+            self.tree.set_children(node, *order)
+        job['entries'] = entries
+        job['index'] = len(entries)
+    
+    def ensure_populated(self, node, callback):
+        """确保节点的子项已经填充完成后再调用callback"""
+        children = self.tree.get_children(node)
+        if len(children) == 1 and self.tree.item(children[0])['text'] == '':
+            self.tree.delete(children[0])
+            self.populate_node(node, callback)
+            return
+        job = self.populate_jobs.get(node)
+        if job and not job['done']:
+            job['callbacks'].append(callback)
+        else:
+            callback()
+    
+    @staticmethod
+    def split_path(path):
+        """把绝对路径拆分为根节点路径和各级名称，Windows为('C:\\', [...])，POSIX为('/', [...])"""
+        path = os.path.normpath(os.path.abspath(path))
+        drive, rest = os.path.splitdrive(path)
+        root = drive + os.sep if drive else os.sep
+        return root, [part for part in rest.split(os.sep) if part]
+    
+    def expand_to_path(self, path, callback=None):
+        """展开到指定路径，各级目录填充完成后选中最后的节点并调用callback
+        
+        通过路径索引逐级查找节点，耗时与路径深度成正比。
+        """
         try:
             if not os.path.exists(path):
                 messagebox.showinfo("提示", "目录不存在")
                 return
             
-            # 标准化路径格式
-            path = os.path.normpath(path)
-            
-            # 首先找到对应的驱动器节点
-            drive = os.path.splitdrive(path)[0] + '\\'
-            drive_node = None
-            
-            # 查找驱动器节点
-            for item in self.tree.get_children(''):
-                values = self.tree.item(item)['values']
-                if values and values[0].upper() == drive.upper():
-                    drive_node = item
-                    break
+            # 首先找到对应的根节点（Windows为驱动器，其他系统为/）
+            root, parts = self.split_path(path)
+            root_node = self.find_tree_item(root)
+            if not root_node:
+                return
             
-            if drive_node:
-                # 展开驱动器节点
-                self.tree.item(drive_node, open=True)
-                children = self.tree.get_children(drive_node)
-                if children and self.tree.item(children[0])['text'] == '':
-                    self.tree.delete(children[0])
-                    self.populate_node(drive_node)
+            def expand_next(current, current_path, index):
+                # 逐级展开目录
+                if index < len(parts):
+                    child_path = os.path.join(current_path, parts[index])
+                    child = self.find_tree_item(child_path)
+                    if child:
+                        self.tree.item(child, open=True)
+                        # 展开子节点
+                        self.ensure_populated(child, lambda: expand_next(child, child_path, index + 1))
+                        return
                 
-                # 获取剩余的路径部分
-                remaining_path = path[len(drive):]
-                if remaining_path:
-                    parts = remaining_path.split('\\')
-                    current = drive_node
-                    
-                    # 逐级展开目录
-                    for part in parts:
-                        if not part:  # 跳过空字符串
-                            continue
-                        found = False
-                        for child in self.tree.get_children(current):
-                            if self.tree.item(child)['text'] == part:
-                                current = child
-                                self.tree.item(child, open=True)
-                                # 展开子节点
-                                children = self.tree.get_children(child)
-                                if children and self.tree.item(children[0])['text'] == '':
-                                    self.tree.delete(children[0])
-                                    self.populate_node(child)
-                                found = True
-                                break
-                        if not found:
-                            break
-                    
-                    # 选中最后的节点并展开
-                    if current:
-                        self.tree.selection_set(current)
-                        self.tree.see(current)
-                        self.tree.focus(current)
-                        # 触发选择事件来展开目录
-                        self.on_tree_select(None)
+                # 选中最后的节点并展开
+                if parts and current:
+                    self.tree.selection_set(current)
+                    self.tree.see(current)
+                    self.tree.focus(current)
+                    # 触发选择事件来展开目录
+                    self.on_tree_select(None)
+                if callback:
+                    callback()
+            
+            # 展开根节点
+            self.tree.item(root_node, open=True)
+            self.ensure_populated(root_node, lambda: expand_next(root_node, root, 0))
         except Exception as e:
             print(f"展开路径时出错: {e}")
     
@@ -454,6 +2531,7 @@ class ImageViewer:
         if os.path.isfile(file_path):
             self.display_image(file_path)
             self.last_visited_directory = os.path.dirname(file_path)
+            self.prefetch_neighbours(selected_item)
         else:
             # 如果是目录，切换展开/收拢状态
             self.last_visited_directory = file_path
@@ -467,182 +2545,719 @@ class ImageViewer:
                     self.populate_node(selected_item)
     
     def display_image(self, file_path):
-        self.current_image = Image.open(file_path)
-        self.current_file_path = file_path  # 存当前文件路径
-        self.load_image_config(file_path)  # 加载置
+        with TRACER.span('open_file', path=file_path):
+            if self.performance_mode:
+                self.stop_performance()
+            self.current_file_path = file_path  # 存当前文件路径
+            self.load_image_config(file_path)  # 加载置
+            self.close_tiles()
+            
+            # 先只读取文件头，页面都能从缓存得到时不必解码，需要时由show_image()解码
+            self.current_image = None
+            self.current_pyramid = None
+            # 上一份乐谱的缩放图像不再需要，先释放，避免与新图片的解码结果同时占用内存
+            self.page_image = None
+            self.page_image_key = None
+            self.page_layout = None
+            self.current_image_key = self.image_cache.make_key(file_path)
+            self.current_image_size = read_image_size(file_path)
+            if self.is_huge_size(self.current_image_size):
+                self.open_tiled_image(file_path)
+                return
+            self.show_image()
+    
+    def is_huge_size(self, size):
+        """判断图像是否大到需要使用磁盘分级缓存"""
+        return size[0] * size[1] > self.CONFIG['tiled_threshold_mpx'] * 1000000
+    
+    def is_huge_image(self, file_path):
+        """只读取文件头判断图像是否大到需要使用磁盘分级缓存"""
+        try:
+            return self.is_huge_size(read_image_size(file_path))
+        except Exception:
+            return False
+    
+    def open_tiled_image(self, file_path):
+        """打开超大图像的分级缓存，缓存不存在时在后台建立"""
+        cache_path = TiledImageStore.cache_path_for(self.get_cache_dir(), self.current_image_key)
+        
+        tiles = TiledImageStore.open(cache_path)
+        if tiles is not None:
+            self.apply_tiles(file_path, tiles)
+            return
+        
+        # 建立缓存需要一段时间，先清空画布并显示提示
+        self.render_generation += 1
+        self.canvas.delete("all")
+        self.canvas.image = None
+        self.pages = {}
+        self.page_layout = None
+        self.canvas.create_text(20, 20, anchor='nw', text="正在为超大图像建立缓存…", fill='gray')
+        self.tile_executor.submit(self.build_tiles, file_path, cache_path, self.get_cache_dir())
+    
+    def build_tiles(self, file_path, cache_path, cache_dir):
+        """后台线程：把超大图像转换为分级缓存，并按容量淘汰最久未使用的缓存"""
+        try:
+            tiles = TiledImageStore.open(cache_path)
+            if tiles is None:
+                tiles = TiledImageStore.build(file_path, cache_path)
+                TiledImageStore.trim(cache_dir, self.tile_cache_bytes)
+        except Exception as e:
+            print(f"建立超大图像缓存出错: {file_path}: {e}")
+            return
+        self.run_on_ui(self.apply_tiles, file_path, tiles)
+    
+    def apply_tiles(self, file_path, tiles):
+        """界面线程：显示已建立缓存的超大图像，期间已切换到其他文件时直接关闭"""
+        if file_path != self.current_file_path:
+            tiles.close()
+            return
+        self.close_tiles()
+        self.current_tiles = tiles
         self.show_image()
     
+    def close_tiles(self):
+        """关闭当前超大图像的分级缓存"""
+        if self.current_tiles is not None:
+            self.current_tiles.close()
+            self.current_tiles = None
+    
+    def load_current_image(self):
+        """按当前缩放比例解码当前文件，缩小显示时只解码需要的分辨率"""
+        self.current_image = self.image_cache.load(self.current_file_path, self.scale)
+        self.current_image_key = self.image_cache.make_key(self.current_file_path)
+        self.current_image_size = self.current_image.info['full_size']
+        self.current_pyramid = ImagePyramid(self.current_image)
+    
+    def run_on_ui(self, func, *args):
+        """从后台线程提交需要在界面线程中执行的操作"""
+        self.ui_queue.put((func, args))
+    
+    def poll_ui_queue(self):
+        """在界面线程中执行后台线程提交的操作"""
+        try:
+            while True:
+                func, args = self.ui_queue.get_nowait()
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"执行后台任务回调出错: {e}")
+        except queue.Empty:
+            pass
+        self.root.after(15, self.poll_ui_queue)
+    
     def show_image(self):
-        if self.current_image:
-            width, height = self.current_image.size
+        """显示当前图片并记录耗时，请求了性能分析时对本次渲染做cProfile分析"""
+        if self.pending_profile is not None:
+            # 上次分析的后台缩放被这次渲染取代，只保存界面线程部分
+            self.save_profile([self.pending_profile])
+        self.pending_profile = None
+        self.profile_generation = None
+        
+        # 提交后台缩放之前就确定是否分析，start_render据此让后台线程同样分析
+        profiler = None
+        if self.profile_requested:
+            self.profile_requested = False
+            profiler = cProfile.Profile()
+            self.pending_profile = profiler
+            profiler.enable()
+        
+        with TRACER.span('show_image'):
+            rendering = self.draw_current_image()
+        self.schedule_memory_update()
+        
+        if profiler is not None:
+            profiler.disable()
+            if rendering:
+                # 后台线程中的高质量缩放完成后一起保存
+                self.profile_generation = self.render_generation
+            else:
+                self.pending_profile = None
+                self.save_profile([profiler])
+        self.update_hud()
+    
+    def draw_current_image(self):
+        """显示当前图片，在后台开始生成高质量图像时返回True"""
+        if self.current_tiles is not None:
+            self.show_tiled_image()
+        elif self.current_image_size:
+            width, height = self.current_image_size
             scaled_width = int(width * self.scale)
             scaled_height = int(height * self.scale)
+            canvas_height = self.canvas.winfo_height()
+            self.save_canvas_height(canvas_height)
             
-            # 缩放图片
-            image = self.current_image.resize(
-                (scaled_width, scaled_height), 
-                Image.Resampling.LANCZOS
+            # 预读时已经缩放好的图像，或磁盘缓存中已有全部页面时，不必解码和缩放
+            scaled_key = self.current_image_key + (self.scale,)
+            cached_image = self.scaled_cache.get(scaled_key)
+            if cached_image is None and self.page_image_key == scaled_key:
+                # 缩放比例没变时（只改变了重叠比例或画布高度），正在显示的缩放图像即使不在缓存中也可以继续使用
+                cached_image = self.page_image
+            cached = cached_image is not None or (
+                scaled_height > canvas_height and self.page_disk_cache.has_pages(
+                    self.current_image_key + (self.scale, canvas_height, self.overlap_ratio),
+                    compute_page_layout(scaled_width, scaled_height, canvas_height,
+                                        self.overlap_ratio)['num_pages']
+                )
             )
             
+            # 尚未解码，或放大到超过已解码的分辨率时，需要以更高的分辨率解码；
+            # 已有金字塔时先用它显示预览，重新解码和高质量缩放一起在后台进行
+            decode = not cached and (self.current_image is None or
+                                     self.current_image.size[0] < min(scaled_width, width))
+            if decode and self.current_pyramid is None:
+                self.load_current_image()
+                decode = False
+            
+            # 取消仍在进行的渲染，旧的结果会因为代号不同而被丢弃
+            self.render_generation += 1
+            if self.render_future:
+                self.render_future.cancel()
+            
             # 清空画布
             self.canvas.delete("all")
+            self.canvas.image = None  # 单张显示时的PhotoImage
+            self.pages = {}
+            self.page_layout = None
+            
+            # 高质量图像完成前页面都从金字塔快速生成预览
+            self.page_image = cached_image
+            self.page_image_key = scaled_key if cached_image is not None else None
             
             # 如果片高度超过画布高度，进行拆分显示
-            canvas_height = self.canvas.winfo_height()
             if scaled_height > canvas_height:
-                self.split_image(image, scaled_width, scaled_height, canvas_height)
+                self.split_image(self.page_image, scaled_width, scaled_height, canvas_height)
             else:
                 # 显示单个图片
-                photo = ImageTk.PhotoImage(image)
-                self.canvas.create_image(0, 0, anchor='nw', image=photo)
+                if self.page_image is not None:
+                    preview = self.page_image
+                else:
+                    preview = self.current_pyramid.preview_region(
+                        (scaled_width, scaled_height),
+                        (0, 0, scaled_width, scaled_height)
+                    )
+                photo = ImageTk.PhotoImage(preview)
+                self.canvas.create_image(0, 0, anchor='nw', image=photo, tags='single_image')
                 self.canvas.image = photo  # 保持引用
+            
+            if cached:
+                self.render_future = None
+                return False
+            
+            self.start_render(scaled_width, scaled_height, decode)
+            return True
+        return False
     
-    def split_image(self, image, width, height, canvas_height):
-        # 计算需要的页面数
-        overlap = int(canvas_height * self.overlap_ratio)  # 使用动态重叠比例
-        effective_height = canvas_height - overlap
-        num_pages = (height + effective_height - 1) // effective_height
+    def start_render(self, scaled_width, scaled_height, decode=False):
+        """在后台线程中生成高质量图像，decode为True时先以当前缩放比例需要的分辨率重新解码"""
+        self.render_future = self.render_executor.submit(
+            self.render_refined_image,
+            self.render_generation,
+            self.current_image_key + (self.scale,),
+            self.current_pyramid,
+            (scaled_width, scaled_height),
+            self.current_file_path if decode else None,
+            self.pending_profile is not None
+        )
+    
+    def save_canvas_height(self, canvas_height):
+        """记录画布高度，预渲染页面时按此高度分页"""
+        if canvas_height > 1:
+            self.save_config(self.CONFIG_KEYS['CANVAS_HEIGHT'], str(canvas_height))
+    
+    def show_tiled_image(self):
+        """显示超大图像：每页直接从分级缓存读取，先显示快速预览，再逐页替换为高质量图像"""
+        width, height = self.current_tiles.size
+        scaled_width = max(1, int(width * self.scale))
+        scaled_height = max(1, int(height * self.scale))
         
-        # 计算每个页面的宽度，为原始宽度加上边框空间
-        page_width = width + 20  # 添加边框空间
+        self.render_generation += 1
+        if self.render_future:
+            self.render_future.cancel()
+            self.render_future = None
         
-        # 调整画布大小以容纳所有页面
-        total_width = page_width * num_pages
-        self.canvas.config(scrollregion=(0, 0, total_width, canvas_height))
+        self.canvas.delete("all")
+        self.canvas.image = None
+        self.pages = {}
+        self.page_layout = None
+        self.page_image = None
+        self.page_image_key = None
         
-        # 存所有的PhotoImage对象
-        self.photo_images = []
-        
-        # 建遮罩图像（如果需要）
-        if self.show_mask.get():
-            # 创建一个纯半透明遮罩图像
-            mask_color = (144, 238, 144, 25)  # 浅绿色，alpha=25 (90%透明)
-            mask_image = Image.new('RGBA', (width, overlap), mask_color)  # 只创建重叠分高度的遮罩
-            mask_photo = ImageTk.PhotoImage(mask_image)
-            self.photo_images.append(mask_photo)  # 保持引用
-        
-        # 显示每个页面
-        for i in range(num_pages):
-            # 计算当前页面的起始位置
-            start_y = i * (canvas_height - overlap)
-            
-            # 创建当前页面的图像
-            page_height = min(canvas_height, height - start_y)
-            page = image.crop((0, start_y, width, start_y + page_height))
-            photo = ImageTk.PhotoImage(page)
-            self.photo_images.append(photo)
-            
-            # 在画布上显示当前页面
-            x = i * page_width + 10
-            
-            # 绘制漂亮的边框
-            border_x = x - 5
-            
-            # 先画主边框
-            self.canvas.create_rectangle(
-                border_x, 5,
-                border_x + width + 10, canvas_height - 5,
-                outline='#4a90e2',
-                width=2,
-                dash=None
-            )
-            
-            # 添加内阴影效果 - 所有页面都画完整的三边阴影
-            # 边阴影
-            self.canvas.create_line(
-                border_x + 1, 6,
-                border_x + width + 9, 6,
-                fill='#2c3e50',
-                width=1
+        canvas_height = self.canvas.winfo_height()
+        if scaled_height > canvas_height:
+            self.split_image(None, scaled_width, scaled_height, canvas_height)
+        else:
+            image = self.current_tiles.read_region(
+                (scaled_width, scaled_height), (0, 0, scaled_width, scaled_height)
             )
-            
-            # 左边阴影
-            self.canvas.create_line(
-                border_x + 1, 6,
-                border_x + 1, canvas_height - 6,
-                fill='#2c3e50',
-                width=1
+            photo = ImageTk.PhotoImage(image)
+            self.canvas.create_image(0, 0, anchor='nw', image=photo, tags='single_image')
+            self.canvas.image = photo
+    
+    def schedule_page_refine(self):
+        """超大图像的新页面以预览质量创建，安排逐页替换为高质量图像"""
+        if not self.page_refine_scheduled:
+            self.page_refine_scheduled = True
+            generation = self.render_generation
+            self.root.after(1, lambda: self.refine_next_page(generation))
+    
+    def render_refined_image(self, generation, key, pyramid, size, decode_path=None, profile=False):
+        """后台线程：使用LANCZOS生成高质量缩放图像，给出decode_path时先重新解码，profile为True时做cProfile分析"""
+        if generation != self.render_generation:
+            return
+        profiler = None
+        if profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            if decode_path is not None:
+                # 放大超过了已解码的分辨率，界面上先显示旧分辨率的预览
+                image = self.image_cache.load(decode_path, key[-1])
+                pyramid = ImagePyramid(image)
+                self.run_on_ui(self.apply_decoded_image, generation, image, pyramid)
+                if generation != self.render_generation:
+                    return
+            # 缩放图片，缩小时从金字塔中最接近的级别开始重采样
+            with TRACER.span('resize', size=size):
+                image = pyramid.resize(size, Image.Resampling.LANCZOS)
+        except Exception as e:
+            print(f"生成高质量图像出错: {e}")
+            return
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.run_on_ui(self.finish_profile, generation, profiler)
+        # 即使结果已经过期也放入缓存，之后回到相同的缩放比例时可以直接使用
+        self.scaled_cache.put(key, image)
+        self.run_on_ui(self.apply_refined_image, generation, key, image)
+    
+    def apply_decoded_image(self, generation, image, pyramid):
+        """界面线程：后台以更高分辨率解码的图像替换当前图像，之后的预览都从新的金字塔生成"""
+        if generation != self.render_generation:
+            return
+        self.current_image = image
+        self.current_pyramid = pyramid
+        self.schedule_memory_update()
+    
+    def apply_refined_image(self, generation, key, image):
+        """界面线程：用高质量图像替换预览"""
+        if generation != self.render_generation:
+            return
+        self.page_image = image
+        self.page_image_key = key
+        self.schedule_memory_update()
+        
+        if not self.page_layout:
+            # 单个图片直接替换
+            photo = ImageTk.PhotoImage(image)
+            self.canvas.itemconfigure('single_image', image=photo)
+            self.canvas.image = photo
+            return
+        
+        # 缩放比例和重叠比例已经确定时，所有页面在后台写入磁盘缓存，下次打开时不必重新渲染
+        if self.page_store_timer is None:
+            self.store_current_pages()
+        
+        # 分页显示时逐页替换，每次只处理一页，避免阻塞界面
+        self.refine_next_page(generation)
+    
+    def store_current_pages(self):
+        """把当前显示的高质量页面交给后台线程写入磁盘缓存"""
+        layout = self.page_layout
+        if not layout:
+            return
+        if self.current_tiles is not None:
+            # 超大图像逐页生成，只写入已经完成的页面
+            for i, page in self.pages.items():
+                key = self.get_page_key(i)
+                if page['refined'] and key not in self.page_disk_cache:
+                    self.page_writer.submit(self.page_disk_cache.put, key, page['bitmap'])
+        elif self.page_image is not None and self.page_image_key == self.current_image_key + (self.scale,):
+            self.page_writer.submit(
+                self.store_pages,
+                self.current_image_key + (self.scale, layout['canvas_height'], layout['overlap_ratio']),
+                self.page_image,
+                layout
             )
-            
-            # 下边阴影 - 每一页画
-            self.canvas.create_line(
-                border_x + 1, canvas_height - 6,
-                border_x + width + 9, canvas_height - 6,
-                fill='#2c3e50',
-                width=1
+    
+    def schedule_page_store(self):
+        """缩放比例或重叠比例改变后，停止操作一段时间再写入页面"""
+        if self.page_store_timer:
+            self.root.after_cancel(self.page_store_timer)
+        self.page_store_timer = self.root.after(self.CONFIG['image_config_flush_delay'], self.store_settled_pages)
+    
+    def store_settled_pages(self):
+        self.page_store_timer = None
+        self.store_current_pages()
+    
+    def store_pages(self, key_prefix, image, layout):
+        """后台线程：把高质量图像的所有页面写入磁盘缓存"""
+        for i in range(layout['num_pages']):
+            key = key_prefix + (i,)
+            if key not in self.page_disk_cache:
+                self.page_disk_cache.put(key, image.crop(get_page_box(layout, i)))
+    
+    def refine_next_page(self, generation):
+        """把下一个仍是预览质量的页面替换为高质量图像，优先处理可见页面"""
+        self.page_refine_scheduled = False
+        if generation != self.render_generation or not self.page_layout:
+            return
+        
+        pending = [i for i, page in self.pages.items() if not page['refined']]
+        if not pending:
+            return
+        
+        first_page, last_page = self.get_visible_page_range()
+        pending.sort(key=lambda i: (not first_page <= i <= last_page, i))
+        i = pending[0]
+        
+        self.page_refine_scheduled = True
+        if self.current_tiles is not None and not self.is_page_refined(i):
+            # 从分级缓存读取并用LANCZOS缩放一页需要几十到几百毫秒，在后台线程中进行
+            layout = self.page_layout
+            self.render_executor.submit(
+                self.render_tile_page, generation, i, self.current_tiles,
+                (layout['width'], layout['height']), get_page_box(layout, i), self.get_page_key(i)
             )
-            
-            # 显示图片
-            self.canvas.create_image(x, 10, anchor='nw', image=photo)
-            
-            # 如果启用了遮罩，添加半透明遮罩
-            if self.show_mask.get():
-                if i == 0:  # 第一页
-                    # 在底部添加罩
-                    self.canvas.create_image(
-                        x, canvas_height - overlap + 10,  # 起点
-                        anchor='nw',
-                        image=mask_photo
-                    )
-                else:  # 其他页
-                    # 在顶部添加遮罩
-                    self.canvas.create_image(
-                        x, 10,  # 起
-                        anchor='nw',
-                        image=mask_photo
-                    )
-                    
-                    # 如果不是最后一页，底部也添加遮罩
-                    if i < num_pages - 1:
-                        self.canvas.create_image(
-                            x, canvas_height - overlap + 10,  # 起点
-                            anchor='nw',
-                            image=mask_photo
-                        )
-            
-            # 添加重叠部分的分隔线
-            if i == 0:  # 第一页
-                # 在底部画红线
-                self.canvas.create_line(
-                    x, canvas_height - overlap + 10,  # 起点
-                    x + width, canvas_height - overlap + 10,  # 终点
-                    fill='red',
-                    width=1
-                )
-            else:  # 其他
-                # 在顶部画红线
-                self.canvas.create_line(
-                    x, overlap + 10,  # 起点
-                    x + width, overlap + 10,  # 终点
-                    fill='red',
-                    width=1
+            return
+        self.replace_page_bitmap(i, self.get_page_bitmap(i))
+        self.root.after(1, lambda: self.refine_next_page(generation))
+    
+    def render_tile_page(self, generation, i, tiles, size, box, key):
+        """后台线程：从超大图像的分级缓存生成一页高质量图像"""
+        page = None
+        if generation == self.render_generation:
+            try:
+                with TRACER.span('tile_read', page=i, preview=False):
+                    page = tiles.read_region(size, box)
+                self.page_cache.put(key, page)
+            except Exception as e:
+                # 期间切换了文件，分级缓存已经关闭
+                print(f"读取超大图像页面出错: {e}")
+                page = None
+        self.run_on_ui(self.apply_tile_page, generation, i, page)
+    
+    def apply_tile_page(self, generation, i, bitmap):
+        """界面线程：替换后台生成的页面，然后继续处理下一页"""
+        self.page_refine_scheduled = False
+        if generation != self.render_generation:
+            # 期间重新显示了超大图像，新页面的替换被推迟到这里
+            if self.current_tiles is not None and any(not page['refined'] for page in self.pages.values()):
+                self.schedule_page_refine()
+            return
+        if bitmap is None:
+            return  # 出错时不再重试，避免反复失败
+        if i in self.pages and not self.pages[i]['refined']:
+            self.replace_page_bitmap(i, bitmap)
+            if self.page_store_timer is None:
+                self.page_writer.submit(self.page_disk_cache.put, self.get_page_key(i), bitmap)
+        self.schedule_page_refine()
+    
+    def replace_page_bitmap(self, i, bitmap):
+        """把第i页的预览替换为高质量图像"""
+        page = self.pages[i]
+        page['bitmap'] = bitmap
+        page['refined'] = True
+        page['photo'] = self.make_page_photo(get_page_descriptor(self.page_layout, i), bitmap)
+        self.canvas.itemconfigure(page['image_item'], image=page['photo'])
+        self.draw_overlay_items(i)
+        self.schedule_memory_update()
+    
+    def split_image(self, image, width, height, canvas_height):
+        # 计算页面数和每页的宽度（原始宽度加上边框空间），使用动态重叠比例
+        layout = compute_page_layout(width, height, canvas_height, self.overlap_ratio)
+        
+        # 调整画布大小以容纳所有页面
+        self.canvas.config(scrollregion=(0, 0, layout['total_width'], canvas_height))
+        
+        # 保存分页参数，页面在滚动到可视区域附近时才创建
+        self.page_image = image
+        self.page_layout = layout
+        
+        # 存所有的PhotoImage对象
+        self.pages = {}  # 页码 -> {'photo', 'overlays', 'overlay_items', 'bitmap', 'image_item', 'refined'}
+        
+        # 只显示可视区域附近的页面
+        self.update_visible_pages()
+    
+    def on_canvas_xscroll(self, first, last):
+        """画布横向滚动时同步滚动条，并更新可视页面"""
+        self.scrollbar.set(first, last)
+        if self.page_layout and not self.page_update_pending:
+            # 合并同一轮事件中的多次滚动，空闲时再更新页面
+            self.page_update_pending = True
+            self.root.after_idle(self.update_visible_pages)
+    
+    def get_visible_page_range(self):
+        """根据画布的横向位置计算当前可见的页码范围"""
+        first, last = self.canvas.xview()
+        return get_page_range(self.page_layout, first, last)
+    
+    def update_visible_pages(self):
+        """创建可视区域附近的页面，并释放远离可视区域的页面"""
+        self.page_update_pending = False
+        layout = self.page_layout
+        if not layout:
+            return
+        
+        first_page, last_page = self.get_visible_page_range()
+        
+        # 创建可视页面及两侧预读范围内的页面，内存超出预算时只保留可见页面
+        lookahead = 0 if self.memory_pressure else self.CONFIG['page_lookahead']
+        for i in range(max(0, first_page - lookahead),
+                       min(layout['num_pages'], last_page + lookahead + 1)):
+            if i not in self.pages:
+                self.create_page(i)
+        
+        if any(not page['refined'] for page in self.pages.values()) and self.current_tiles is not None:
+            self.schedule_page_refine()
+        
+        # 释放离可视区域太远的页面，释放范围比创建范围大，避免来回滚动时反复创建
+        release_distance = 0 if self.memory_pressure else self.CONFIG['page_release_distance']
+        for i in list(self.pages):
+            if i < first_page - release_distance or i > last_page + release_distance:
+                self.release_page(i)
+        self.schedule_memory_update()
+    
+    def release_page(self, i):
+        """删除页面的画布项目并释放其图像"""
+        self.canvas.delete(f"page{i}")
+        del self.pages[i]
+    
+    def get_page_key(self, i):
+        """页面缓存的键"""
+        layout = self.page_layout
+        return self.current_image_key + (
+            self.scale, layout['canvas_height'], layout['overlap_ratio'], i
+        )
+    
+    def is_page_refined(self, i):
+        """第i页现在能否直接得到高质量图像"""
+        key = self.get_page_key(i)
+        if key in self.page_cache or key in self.page_disk_cache:
+            return True
+        return self.current_tiles is None and self.page_image is not None
+    
+    def get_page_bitmap(self, i, preview=False):
+        """获取第i页的图像，高质量图像尚未完成时生成快速预览"""
+        layout = self.page_layout
+        width = layout['width']
+        height = layout['height']
+        
+        # 计算当前页面的起始位置和高度
+        box = get_page_box(layout, i)
+        
+        # 只缓存高质量的页面，切换遮罩或重新显示时不必重新裁剪
+        key = self.get_page_key(i)
+        page = self.page_cache.get(key)
+        if page is not None:
+            return page
+        with TRACER.span('page_disk_read', page=i):
+            page = self.page_disk_cache.get(key)
+        if page is not None:
+            self.page_cache.put(key, page)
+            return page
+        
+        if self.current_tiles is not None:
+            # 超大图像只从磁盘读取与本页相交的行
+            with TRACER.span('tile_read', page=i, preview=preview):
+                if preview:
+                    return self.current_tiles.read_region((width, height), box, Image.Resampling.NEAREST)
+                page = self.current_tiles.read_region((width, height), box)
+        elif self.page_image is None:
+            if self.current_pyramid is None:
+                # 显示期间磁盘缓存中的页面被淘汰，补充解码并在后台生成高质量图像
+                self.load_current_image()
+                self.start_render(width, height)
+            with TRACER.span('preview', page=i):
+                return self.current_pyramid.preview_region((width, height), box)
+        else:
+            with TRACER.span('crop', page=i):
+                page = self.page_image.crop(box)
+        self.page_cache.put(key, page)
+        return page
+    
+    def create_page(self, i):
+        """创建单个页面的图像和画布项目"""
+        page = get_page_descriptor(self.page_layout, i)
+        
+        # 创建当前页面的图像
+        refined = self.is_page_refined(i)
+        bitmap = self.get_page_bitmap(i, preview=not refined)
+        photo = self.make_page_photo(page, bitmap)
+        self.pages[i] = {
+            'photo': photo,
+            'overlays': [],  # 重叠部分染色后的图像[(x, y, PhotoImage)]，启用遮罩时才生成
+            'overlay_items': [],
+            'bitmap': bitmap,
+            'image_item': None,
+            'refined': refined
+        }
+        
+        with TRACER.span('canvas_items', page=i):
+            if self.compositor_enabled.get():
+                # 装饰已画进图像，页面位置的左上角对齐即可
+                self.pages[i]['image_item'] = self.canvas.create_image(
+                    i * self.page_layout['page_width'], 0, anchor='nw', image=photo, tags=f"page{i}"
                 )
-                
-                # 如果不是最后一页，在底部也画红线
-                if i < num_pages - 1:
-                    self.canvas.create_line(
-                        x, canvas_height - overlap + 10,  # 起
-                        x + width, canvas_height - overlap + 10,  # 终点
-                        fill='red',
-                        width=1
-                    )
-            
-            # 添加码和重叠比例信息
-            self.canvas.create_text(
-                border_x + width/2 + 5,
-                canvas_height - 20,
-                text=f"第 {i+1}/{num_pages} 页 (重叠: {int(self.overlap_ratio*100)}%)",
-                fill='#4a90e2',
-                font=('Arial', 10)
+            else:
+                self.draw_page_items(i, page, photo)
+            self.draw_overlay_items(i)
+    
+    def get_label_font(self):
+        """合成页面时页码使用的字体，首次使用时加载，没有可用字体时返回None"""
+        if self.label_font is None:
+            self.label_font = load_label_font(13) or False
+        return self.label_font or None
+    
+    def make_page_photo(self, page, bitmap):
+        """把页面图像转换为PhotoImage，合成模式下先画上边框等装饰"""
+        if self.compositor_enabled.get():
+            with TRACER.span('compose', page=page.index):
+                bitmap = compose_page(self.page_layout, page, bitmap, self.get_label_font())
+        with TRACER.span('photoimage', page=page.index):
+            return ImageTk.PhotoImage(bitmap)
+    
+    def make_overlay_photos(self, page, bitmap, refined):
+        """生成重叠部分染色后的不透明小图像[(x, y, PhotoImage)]
+        
+        重叠部分的遮罩不由Tk半透明叠加，而是把重叠的行染色后盖在页面对应的行上。
+        高质量页面的染色结果按页面键（包含重叠比例）放入页面缓存，重新创建页面时不必再染色。
+        """
+        layout = self.page_layout
+        compositor = self.compositor_enabled.get()
+        if compositor:
+            # 合成模式下从整页的坐标截取，分隔线和页码也在其中
+            x = page.index * layout['page_width']
+            bands = [(x, y, (0, y, layout['page_width'], min(y + layout['overlap'], layout['canvas_height'])))
+                     for y in page.mask_ys]
+        else:
+            bands = [(page.x, PAGE_MARGIN + top, (0, max(0, top), bitmap.size[0], min(bitmap.size[1], bottom)))
+                     for top, bottom in get_overlap_rows(layout, page)]
+        
+        key_prefix = self.get_page_key(page.index) + ('tint', compositor)
+        tinted_page = None
+        overlays = []
+        with TRACER.span('tint', page=page.index):
+            for x, y, box in bands:
+                if box[3] <= box[1]:
+                    continue
+                key = key_prefix + (y,)
+                band = self.page_cache.get(key) if refined else None
+                if band is None:
+                    if compositor:
+                        if tinted_page is None:
+                            # 分隔线和页码画在遮罩之上，从染色后重新合成的页面中截取重叠的行
+                            tinted_page = compose_page(layout, page,
+                                                       tint_overlap(bitmap, get_overlap_rows(layout, page)),
+                                                       self.get_label_font())
+                        band = tinted_page.crop(box)
+                    else:
+                        band = tint_overlap(bitmap.crop(box), [(0, box[3] - box[1])])
+                    if refined:
+                        self.page_cache.put(key, band)
+                overlays.append((x, y, band))
+        with TRACER.span('photoimage', page=page.index):
+            return [(x, y, ImageTk.PhotoImage(band)) for x, y, band in overlays]
+    
+    def draw_overlay_items(self, i):
+        """重新创建页面的遮罩项目：启用遮罩时生成染色的图像并盖在页面图像上方，否则只删除旧的项目"""
+        page = self.pages[i]
+        for item in page['overlay_items']:
+            self.canvas.delete(item)
+        page['overlays'] = []
+        page['overlay_items'] = []
+        if not self.show_mask.get():
+            return
+        page['overlays'] = self.make_overlay_photos(get_page_descriptor(self.page_layout, i),
+                                                    page['bitmap'], page['refined'])
+        for x, y, photo in page['overlays']:
+            item = self.canvas.create_image(x, y, anchor='nw', image=photo, tags=(f"page{i}", 'mask'))
+            # 遮罩在页面图像之上、分隔线和页码之下
+            self.canvas.tag_raise(item, page['image_item'])
+            page['overlay_items'].append(item)
+    
+    def draw_page_items(self, i, page, photo):
+        """绘制页面的边框、图像、遮罩、分隔线和页码"""
+        layout = self.page_layout
+        width = layout['width']
+        tag = f"page{i}"
+        
+        # 绘制漂亮的边框
+        border_x0, border_y0, border_x1, border_y1 = page.border
+        
+        # 先画主边框
+        self.canvas.create_rectangle(
+            *page.border,
+            outline='#4a90e2',
+            width=2,
+            dash=None,
+            tags=tag
+        )
+        
+        # 添加内阴影效果 - 所有页面都画完整的三边阴影
+        # 边阴影
+        self.canvas.create_line(
+            border_x0 + 1, border_y0 + 1,
+            border_x1 - 1, border_y0 + 1,
+            fill='#2c3e50',
+            width=1,
+            tags=tag
+        )
+        
+        # 左边阴影
+        self.canvas.create_line(
+            border_x0 + 1, border_y0 + 1,
+            border_x0 + 1, border_y1 - 1,
+            fill='#2c3e50',
+            width=1,
+            tags=tag
+        )
+        
+        # 下边阴影 - 每一页画
+        self.canvas.create_line(
+            border_x0 + 1, border_y1 - 1,
+            border_x1 - 1, border_y1 - 1,
+            fill='#2c3e50',
+            width=1,
+            tags=tag
+        )
+        
+        # 显示图片
+        self.pages[i]['image_item'] = self.canvas.create_image(
+            page.x, PAGE_MARGIN, anchor='nw', image=photo, tags=tag
+        )
+        
+        # 添加重叠部分的分隔线
+        for y in page.separator_ys:
+            self.canvas.create_line(
+                page.x, y,
+                page.x + width, y,
+                fill='red',
+                width=1,
+                tags=tag
             )
+        
+        # 添加码和重叠比例信息
+        self.canvas.create_text(
+            *page.label_pos,
+            text=f"第 {i+1}/{layout['num_pages']} 页 (重叠: {int(layout['overlap_ratio']*100)}%)",
+            fill='#4a90e2',
+            font=('Arial', 10),
+            tags=tag
+        )
     
     def zoom_in(self, event):
+        if isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            return  # 在搜索框中输入
         self.scale += 0.1
         self.show_image()
         if hasattr(self, 'current_file_path'):
             self.save_image_config(self.current_file_path)
     
     def zoom_out(self, event):
+        if isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            return  # 在搜索框中输入
         self.scale = max(0.1, self.scale - 0.1)
         self.show_image()
         if hasattr(self, 'current_file_path'):
@@ -656,7 +3271,7 @@ class ImageViewer:
             self.overlap_ratio = max(0.05, self.overlap_ratio - 0.05)  # 小5%重叠
         
         # 重新显示图片
-        if self.current_image:
+        if self.current_image_size:
             self.show_image()
             self.save_image_config(self.current_file_path)  # 保存配置
     
@@ -667,44 +3282,106 @@ class ImageViewer:
             self.root.after_cancel(self.resize_timer) if hasattr(self, 'resize_timer') else None
             self.resize_timer = self.root.after(100, self.show_image)
     
+    def read_image_configs(self, directory):
+        """读取目录中的图片配置，文件不存在或无效时返回None"""
+        return self.image_configs.get(directory)
+    
+    def update_image_config(self, directory, key, value):
+        """修改目录中的图片配置，停止操作一段时间后再写回磁盘"""
+        self.image_configs.update(directory, key, value)
+        if self.image_config_flush_timer:
+            self.root.after_cancel(self.image_config_flush_timer)
+        self.image_config_flush_timer = self.root.after(
+            self.CONFIG['image_config_flush_delay'], self.flush_image_configs
+        )
+    
+    def flush_image_configs(self):
+        """把修改过的图片配置写回磁盘"""
+        self.image_config_flush_timer = None
+        self.image_configs.flush()
+    
     def load_image_config(self, file_path):
         """加载图片配置"""
-        config_path = os.path.join(os.path.dirname(file_path), self.config_filename)
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                configs = json.load(f)
-                image_name = os.path.basename(file_path)
-                if image_name in configs:
-                    config = configs[image_name]
-                    self.scale = config.get('scale', 1.0)
-                    self.overlap_ratio = config.get('overlap_ratio', 0.2)
-        except (FileNotFoundError, json.JSONDecodeError):
+        configs = self.read_image_configs(os.path.dirname(file_path))
+        if configs is None:
             self.scale = 1.0
             self.overlap_ratio = 0.2
+            return
+        image_name = os.path.basename(file_path)
+        if image_name in configs:
+            config = configs[image_name]
+            self.scale = config.get('scale', 1.0)
+            self.overlap_ratio = config.get('overlap_ratio', 0.2)
+    
+    def get_saved_scale(self, file_path):
+        """获取图片保存的缩放比例，与load_image_config的规则一致"""
+        configs = self.read_image_configs(os.path.dirname(file_path))
+        if configs is None:
+            return 1.0
+        # 没有保存过的图片沿用当前的缩放比例
+        return configs.get(os.path.basename(file_path), {}).get('scale', self.scale)
+    
+    def get_neighbour_files(self, item):
+        """返回同一父节点下相邻的图片文件，按距离由近到远排列"""
+        depth = self.CONFIG['prefetch_depth']
+        
+        def collect(step):
+            files = []
+            node = step(item)
+            while node and len(files) < depth:
+                values = self.tree.item(node)['values']
+                if values and str(values[0]).lower().endswith(self.IMAGE_EXTENSIONS):
+                    files.append(str(values[0]))
+                node = step(node)
+            return files
+        
+        following = collect(self.tree.next)
+        preceding = collect(self.tree.prev)
+        
+        # 交替排列，优先预读下一个文件
+        neighbours = []
+        for i in range(depth):
+            neighbours.extend(files[i] for files in (following, preceding) if i < len(files))
+        return neighbours
+    
+    def prefetch_neighbours(self, item):
+        """在后台解码并缩放相邻的文件，选择跳到别处时取消尚未完成的预读"""
+        self.prefetch_generation += 1
+        targets = [(path, self.get_saved_scale(path)) for path in self.get_neighbour_files(item)]
+        if targets:
+            self.prefetch_executor.submit(
+                self.prefetch_files, self.prefetch_generation, self.render_future, targets
+            )
+    
+    def prefetch_files(self, generation, render_future, targets):
+        """后台线程：当前图片显示完成后依次预读相邻文件"""
+        # 等待当前图片渲染完成，避免与其争抢CPU
+        if render_future:
+            wait([render_future])
+        
+        for path, scale in targets:
+            if generation != self.prefetch_generation:
+                return
+            try:
+                key = self.image_cache.make_key(path) + (scale,)
+                if key in self.scaled_cache or self.is_huge_image(path):
+                    continue
+                image = self.image_cache.load(path, scale)
+                width, height = image.info['full_size']
+                size = (int(width * scale), int(height * scale))
+                self.scaled_cache.put(key, ImagePyramid(image).resize(size, Image.Resampling.LANCZOS))
+            except Exception as e:
+                print(f"预读文件出错: {path}: {e}")
     
     def save_image_config(self, file_path):
         """保存图片配置"""
-        config_path = os.path.join(os.path.dirname(file_path), self.config_filename)
-        try:
-            # 尝试加载现有配置
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    configs = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                configs = {}
-            
-            # 更新当前图片的配置
-            image_name = os.path.basename(file_path)
-            configs[image_name] = {
-                'scale': self.scale,
-                'overlap_ratio': self.overlap_ratio
-            }
-            
-            # 保存配置
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(configs, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"无法保存配置件: {e}")
+        # 更新当前图片的配置
+        image_name = os.path.basename(file_path)
+        self.update_image_config(os.path.dirname(file_path), image_name, {
+            'scale': self.scale,
+            'overlap_ratio': self.overlap_ratio
+        })
+        self.schedule_page_store()
     
     def on_closing(self):
         """窗口关闭时的处理"""
@@ -715,12 +3392,48 @@ class ImageViewer:
             elif self.last_visited_directory:
                 # 如果没有打开文件但有访问的目录，保目录路径
                 self.save_last_directory(self.last_visited_directory)
+        
+        self.stop_performance()
+        self.beat_scheduler.stop()
+        
+        # 立即写回尚未保存的设置
+        if self.config_flush_timer:
+            self.root.after_cancel(self.config_flush_timer)
+        self.flush_config()
+        if self.image_config_flush_timer:
+            self.root.after_cancel(self.image_config_flush_timer)
+        self.flush_image_configs()
+        if self.page_store_timer:
+            self.root.after_cancel(self.page_store_timer)
+            self.store_settled_pages()
+        
+        self.render_executor.shutdown(wait=False, cancel_futures=True)
+        self.prefetch_generation += 1
+        self.prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        self.populate_jobs = {}
+        self.listing_executor.shutdown(wait=False, cancel_futures=True)
+        self.tile_executor.shutdown(wait=False, cancel_futures=True)
+        self.page_writer.shutdown(wait=False)  # 尚未写完的页面在退出前写完
+        self.search_executor.shutdown(wait=False, cancel_futures=True)
+        self.cancel_thumbnails()
+        self.thumbnail_pool.shutdown(wait=False, cancel_futures=True)
+        self.close_tiles()
+        self.watcher.stop()
+        
+        stats = self.image_cache.stats()
+        print(f"图像缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+              f"命中率 {stats['hit_rate']:.0%}, "
+              f"占用 {stats['bytes'] / 1024 / 1024:.1f}/{stats['max_bytes'] / 1024 / 1024:.0f} MB")
         self.root.destroy()
     
     def refresh_image(self):
-        """刷新图显示"""
-        if self.current_image:
-            self.show_image()
+        """切换遮罩的显示状态：只修改'mask'标签的画布项目，尚未生成遮罩的页面此时才生成"""
+        if self.current_image_size:
+            if self.show_mask.get():
+                for i, page in self.pages.items():
+                    if not page['overlay_items']:
+                        self.draw_overlay_items(i)
+            self.canvas.itemconfigure('mask', state='normal' if self.show_mask.get() else 'hidden')
             # 保存遮罩状态到配置文件
             try:
                 self.save_config(self.CONFIG_KEYS['MASK_STATE'], str(int(self.show_mask.get())))
@@ -741,7 +3454,7 @@ class ImageViewer:
             else:
                 self.overlap_ratio = max(0.05, self.overlap_ratio - 0.05)
             
-            if self.current_image:
+            if self.current_image_size:
                 self.show_image()
                 if hasattr(self, 'current_file_path'):
                     self.save_image_config(self.current_file_path)
@@ -752,6 +3465,9 @@ class ImageViewer:
                 self.canvas.xview_moveto(current[0] - 0.1)  # 向左滚动
             else:
                 self.canvas.xview_moveto(current[0] + 0.1)  # 向右滚动
+            if self.scroll_anchor:
+                # 连续滚动时从新的位置继续
+                self.scroll_anchor = (time.perf_counter(), self.canvas.canvasx(0))
     
     def start_resize(self, event):
         """开始调整大小时记初始位置"""
@@ -799,20 +3515,14 @@ class ImageViewer:
             self.update_favorites_menu()
     
     def get_favorites(self):
-        """从配置文件获取收藏列表"""
-        try:
-            config = self.load_config()
-            favorites_str = config.get(self.CONFIG_KEYS['FAVORITES'], '[]')
-            return json.loads(favorites_str)
-        except Exception:
-            return []
+        """获取收藏列表的副本"""
+        return list(self.config_store.favorites)
     
     def save_favorites(self, favorites):
         """保存收藏列表到配置文件"""
-        try:
-            self.save_config(self.CONFIG_KEYS['FAVORITES'], json.dumps(favorites))
-        except Exception as e:
-            messagebox.showerror("错误", f"无法保存收藏: {e}")
+        self.config_store.set_favorites(favorites)
+        if self.config_store.dirty:
+            self.schedule_config_flush()
     
     def update_favorites_menu(self):
         """更新收藏夹菜单"""
@@ -841,16 +3551,7 @@ class ImageViewer:
         if os.path.exists(path):
             if os.path.isfile(path):
                 # 如是是文件，展开到文件所在目录并选中文件
-                dir_path = os.path.dirname(path)
-                self.expand_to_path(dir_path)
-                
-                # 选中并显示文件
-                for item in self.tree.get_children(self.tree.focus()):
-                    if self.tree.item(item)['values'][0] == path:
-                        self.tree.selection_set(item)
-                        self.tree.see(item)
-                        self.on_tree_select(None)
-                        break
+                self.open_file_in_tree(path)
             else:
                 # 如果是文件夹，直接展开
                 self.expand_to_path(path)
@@ -862,6 +3563,573 @@ class ImageViewer:
             self.save_favorites(favorites)
             self.update_favorites_menu()
     
+    def show_thumbnail_grid(self):
+        """以缩略图网格显示当前目录中的图片，缩略图生成后陆续显示"""
+        directory = self.last_visited_directory
+        if not directory or not os.path.isdir(directory):
+            messagebox.showinfo("提示", "请先在目录树中选择一个目录")
+            return
+        
+        grid = self.thumbnail_grid
+        if grid is None:
+            dialog = tk.Toplevel(self.root)
+            dialog.geometry("900x600")
+            
+            canvas = tk.Canvas(dialog, bg='white')
+            scrollbar = ttk.Scrollbar(dialog, orient='vertical', command=canvas.yview)
+            canvas.configure(yscrollcommand=scrollbar.set)
+            scrollbar.pack(side='right', fill='y')
+            canvas.pack(side='left', fill='both', expand=True)
+            
+            grid = {'dialog': dialog, 'canvas': canvas, 'cells': [], 'columns': 0, 'futures': []}
+            self.thumbnail_grid = grid
+            canvas.bind('<Configure>', lambda e: self.layout_thumbnail_grid())
+            canvas.bind('<MouseWheel>', lambda e: canvas.yview_scroll(-1 if e.delta > 0 else 1, 'units'))
+            dialog.protocol("WM_DELETE_WINDOW", self.close_thumbnail_grid)
+        else:
+            grid['dialog'].lift()
+        
+        grid['dialog'].title(f"缩略图 - {directory}")
+        self.load_thumbnail_grid(directory)
+    
+    def load_thumbnail_grid(self, directory):
+        """清空网格并在后台列出目录中的图片"""
+        self.cancel_thumbnails()
+        grid = self.thumbnail_grid
+        grid['canvas'].delete('all')
+        grid['cells'] = []
+        grid['directory'] = directory
+        
+        generation = self.thumbnail_generation
+        sort_method = self.get_sort_method(directory)
+        
+        def list_files():
+            time_sort = sort_method in ('time_desc', 'time_asc')
+            entries = self.listing_cache.get(directory, time_sort) or self.listing_cache.scan(directory, time_sort)
+            files = [info for info in self.sort_listing(entries, sort_method) if not info['is_dir']]
+            self.run_on_ui(self.create_thumbnail_cells, generation, files)
+        
+        self.listing_executor.submit(list_files)
+    
+    def create_thumbnail_cells(self, generation, files):
+        """界面线程：为每个文件创建占位格子，再开始加载缩略图"""
+        if generation != self.thumbnail_generation or self.thumbnail_grid is None:
+            return
+        grid = self.thumbnail_grid
+        canvas = grid['canvas']
+        size = self.CONFIG['thumbnail_size']
+        
+        for index, info in enumerate(files):
+            tag = f"cell{index}"
+            cell = {
+                'path': info['path'],
+                'tag': tag,
+                'frame': canvas.create_rectangle(0, 0, size, size, outline='#cccccc', tags=tag),
+                'label': canvas.create_text(0, 0, text=info['name'], width=size, anchor='n', tags=tag),
+                'image_item': None,
+                'photo': None
+            }
+            canvas.tag_bind(tag, '<Button-1>', lambda e, path=info['path']: self.open_file_in_tree(path))
+            grid['cells'].append(cell)
+        
+        grid['columns'] = 0  # 强制重新排列
+        self.layout_thumbnail_grid()
+        self.listing_executor.submit(
+            self.load_thumbnails, generation, [info['path'] for info in files], grid['futures']
+        )
+    
+    def layout_thumbnail_grid(self):
+        """按窗口宽度排列格子，列数变化时才移动画布项目"""
+        grid = self.thumbnail_grid
+        if grid is None:
+            return
+        canvas = grid['canvas']
+        size = self.CONFIG['thumbnail_size']
+        padding = self.CONFIG['thumbnail_padding']
+        cell_width = size + padding
+        cell_height = size + padding + 36  # 留出文件名的空间
+        
+        columns = max(1, (canvas.winfo_width() - padding) // cell_width)
+        if columns == grid['columns']:
+            return
+        grid['columns'] = columns
+        
+        for index, cell in enumerate(grid['cells']):
+            x = padding + (index % columns) * cell_width
+            y = padding + (index // columns) * cell_height
+            canvas.coords(cell['frame'], x, y, x + size, y + size)
+            canvas.coords(cell['label'], x + size / 2, y + size + 4)
+            if cell['image_item']:
+                canvas.coords(cell['image_item'], x + size / 2, y + size / 2)
+        
+        rows = (len(grid['cells']) + columns - 1) // columns
+        canvas.config(scrollregion=(0, 0, columns * cell_width + padding, rows * cell_height + padding))
+    
+    def load_thumbnails(self, generation, paths, futures):
+        """后台线程：读取已缓存的缩略图，未缓存的交给进程池生成"""
+        pending = []
+        for index, path in enumerate(paths):
+            if generation != self.thumbnail_generation:
+                return
+            try:
+                file_key = self.image_cache.make_key(path)
+            except OSError:
+                continue
+            image = self.thumbnail_cache.get(file_key)
+            if image is not None:
+                self.run_on_ui(self.apply_thumbnail, generation, index, image)
+            else:
+                pending.append((index, path, self.thumbnail_cache.path_for(file_key)))
+        
+        # 缓存命中的缩略图先显示，再按顺序生成其余的
+        for index, path, cache_path in pending:
+            if generation != self.thumbnail_generation:
+                return
+            future = self.thumbnail_pool.submit(
+                ThumbnailCache.render, path, cache_path, self.thumbnail_cache.size
+            )
+            future.add_done_callback(
+                lambda f, index=index: self.on_thumbnail_rendered(generation, index, f)
+            )
+            futures.append(future)
+    
+    def on_thumbnail_rendered(self, generation, index, future):
+        """进程池回调线程：把生成的缩略图交给界面线程"""
+        if future.cancelled():
+            return
+        try:
+            mode, size, data = future.result()
+        except Exception as e:
+            print(f"生成缩略图出错: {e}")
+            return
+        self.run_on_ui(self.apply_thumbnail, generation, index, Image.frombytes(mode, size, data))
+    
+    def apply_thumbnail(self, generation, index, image):
+        """界面线程：在格子中显示缩略图"""
+        if generation != self.thumbnail_generation or self.thumbnail_grid is None:
+            return
+        grid = self.thumbnail_grid
+        canvas = grid['canvas']
+        cell = grid['cells'][index]
+        x0, y0, x1, y1 = canvas.coords(cell['frame'])
+        
+        cell['photo'] = ImageTk.PhotoImage(image)
+        cell['image_item'] = canvas.create_image(
+            (x0 + x1) / 2, (y0 + y1) / 2, image=cell['photo'], tags=cell['tag']
+        )
+        self.schedule_memory_update()
+    
+    def cancel_thumbnails(self):
+        """丢弃尚未完成的缩略图任务"""
+        self.thumbnail_generation += 1
+        if self.thumbnail_grid is not None:
+            for future in self.thumbnail_grid['futures']:
+                future.cancel()
+            self.thumbnail_grid['futures'] = []
+    
+    def close_thumbnail_grid(self):
+        """关闭缩略图浏览窗口"""
+        self.cancel_thumbnails()
+        if self.thumbnail_grid is not None:
+            self.thumbnail_grid['dialog'].destroy()
+            self.thumbnail_grid = None
+            self.schedule_memory_update()
+    
+    def open_file_in_tree(self, path, callback=None):
+        """展开到文件所在目录，目录填充完成后选中并显示文件，之后调用callback"""
+        def select_file():
+            item = self.find_tree_item(path)
+            if item:
+                self.tree.selection_set(item)
+                self.tree.see(item)
+                self.on_tree_select(None)
+            else:
+                # 目录树中没有列出的文件（如隐藏文件）直接显示
+                self.display_image(path)
+            if callback:
+                callback()
+        
+        self.expand_to_path(os.path.dirname(path), select_file)
+    
+    def get_search_roots(self):
+        """获取搜索范围，未设置时使用收藏夹中的目录
+        
+        收藏的磁盘根目录（如C:\\或/）不会自动加入，否则每次更新索引都要遍历整个磁盘；
+        需要时可以通过"将当前目录加入搜索范围"明确加入。
+        """
+        value = self.load_config().get(self.CONFIG_KEYS['SEARCH_ROOTS'])
+        if value is None:
+            return [path for path in self.get_favorites()
+                    if os.path.isdir(path) and os.path.dirname(os.path.abspath(path)) != os.path.abspath(path)]
+        try:
+            return list(json.loads(value))
+        except (json.JSONDecodeError, TypeError):
+            return []
+    
+    def save_search_roots(self, roots):
+        self.save_config(self.CONFIG_KEYS['SEARCH_ROOTS'], json.dumps(roots, ensure_ascii=False))
+        self.schedule_search_reindex(0)
+    
+    def add_search_root(self):
+        """把当前目录加入搜索范围"""
+        directory = self.last_visited_directory
+        if not directory or not os.path.isdir(directory):
+            messagebox.showinfo("提示", "请先在目录树中选择一个目录")
+            return
+        roots = self.get_search_roots()
+        if directory not in roots:
+            roots.append(directory)
+            self.save_search_roots(roots)
+        self.show_timed_message(f"已加入搜索范围：{directory}")
+    
+    def remove_search_root(self):
+        """从搜索范围中移除当前目录"""
+        roots = self.get_search_roots()
+        if self.last_visited_directory in roots:
+            roots.remove(self.last_visited_directory)
+            self.save_search_roots(roots)
+            self.show_timed_message(f"已从搜索范围移除：{self.last_visited_directory}")
+        else:
+            messagebox.showinfo("提示", "当前目录不是搜索范围的根目录")
+    
+    def schedule_search_reindex(self, delay_ms=None):
+        """安排在后台更新搜索索引，之后定期检查"""
+        if getattr(self, 'search_reindex_timer', None):
+            self.root.after_cancel(self.search_reindex_timer)
+        if delay_ms is None:
+            delay_ms = self.CONFIG['search_reindex_minutes'] * 60 * 1000
+        
+        def reindex():
+            roots = self.get_search_roots()
+            self.search_executor.submit(self.update_search_index, roots)
+            self.schedule_search_reindex()
+        
+        self.search_reindex_timer = self.root.after(delay_ms, reindex)
+    
+    def update_search_index(self, roots):
+        """后台线程：更新搜索索引，完成后刷新正在显示的搜索结果"""
+        try:
+            self.search_index.update(roots)
+        except sqlite3.Error as e:
+            print(f"更新搜索索引出错: {e}")
+            return
+        self.run_on_ui(self.update_search_results)
+    
+    def update_search_results(self):
+        """按搜索框的内容列出匹配的文件，搜索框为空时隐藏结果列表"""
+        query = self.search_var.get().strip()
+        if not query:
+            self.search_results.pack_forget()
+            self.search_result_paths = []
+            return
+        
+        try:
+            self.search_result_paths = self.search_index.search(query, self.CONFIG['search_limit'])
+        except sqlite3.Error as e:
+            print(f"搜索出错: {e}")
+            self.search_result_paths = []
+        
+        self.search_results.delete(0, 'end')
+        for path in self.search_result_paths:
+            self.search_results.insert('end', f"{os.path.basename(path)}  ({os.path.dirname(path)})")
+        if not self.search_results.winfo_ismapped():
+            self.search_results.pack(side='top', fill='x', padx=2, before=self.inner_tree_frame)
+    
+    def focus_search_results(self):
+        """从搜索框移到结果列表"""
+        if self.search_result_paths:
+            self.search_results.focus_set()
+            self.search_results.selection_clear(0, 'end')
+            self.search_results.selection_set(0)
+            self.search_results.activate(0)
+    
+    def open_search_result(self, index=None):
+        """在目录树中打开选中的搜索结果"""
+        if index is None:
+            selection = self.search_results.curselection()
+            if not selection:
+                return
+            index = selection[0]
+        if index >= len(self.search_result_paths):
+            return
+        path = self.search_result_paths[index]
+        if os.path.isfile(path):
+            self.open_file_in_tree(path)
+        else:
+            messagebox.showwarning("警告", f"文件不存在：\n{path}")
+            self.schedule_search_reindex(0)
+    
+    def toggle_compositor(self):
+        """切换合成模式并重新显示当前图片"""
+        self.save_config(self.CONFIG_KEYS['COMPOSITOR'], '1' if self.compositor_enabled.get() else '0')
+        self.show_image()
+    
+    def toggle_performance(self, mode):
+        """开始或停止自动滚动/翻页，已在以该方式运行时停止"""
+        if self.performance_mode == mode:
+            self.stop_performance()
+        else:
+            self.start_performance(mode)
+    
+    def start_performance(self, mode):
+        """按当前速度开始连续滚动（mode='scroll'）或每隔beats_per_page拍翻一页（mode='page'）"""
+        if not self.page_layout:
+            self.show_timed_message("当前图片只有一页，无需滚动", 1)
+            return
+        self.stop_performance()
+        self.performance_mode = mode
+        set_timer_resolution(True)
+        # 节拍和滚动使用同一个起始时刻，翻页正好落在拍子上
+        origin = time.perf_counter()
+        if mode == 'scroll':
+            self.scroll_anchor = (origin, self.canvas.canvasx(0))
+            self.frame_scheduler.start(origin)
+        self.start_beats(origin)
+    
+    def stop_performance(self):
+        """停止自动滚动，并在控制台输出这段时间的帧间隔统计"""
+        if not self.performance_mode:
+            return
+        for scheduler in (self.frame_scheduler, self.beat_scheduler):
+            summary = scheduler.running and scheduler.stats.summary()
+            if summary:
+                print(f"{scheduler.name}: {summary['frames']} 次, 平均间隔 {summary['mean_ms']:.2f} ms, "
+                      f"抖动 {summary['jitter_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms, "
+                      f"最大 {summary['max_ms']:.2f} ms, 最大延迟 {summary['max_late_ms']:.2f} ms, "
+                      f"丢帧 {summary['dropped']}")
+        self.frame_scheduler.stop()
+        self.performance_mode = None
+        self.scroll_anchor = None
+        set_timer_resolution(False)
+        if not self.metronome_enabled.get():
+            self.beat_scheduler.stop()
+            self.beat_label.place_forget()
+    
+    def start_beats(self, origin=None):
+        """按当前速度重新开始打拍子"""
+        self.beat_scheduler.interval = 60 / self.tempo
+        self.beat_scheduler.start(origin)
+    
+    def toggle_metronome(self):
+        """开关节拍器，自动翻页时拍子继续运行"""
+        if self.metronome_enabled.get():
+            if not self.beat_scheduler.running:
+                self.start_beats()
+        elif not self.performance_mode:
+            self.beat_scheduler.stop()
+            self.beat_label.place_forget()
+    
+    def get_scroll_speed(self):
+        """连续滚动的速度（像素/秒）：每beats_per_page拍滚过一页"""
+        return self.page_layout['page_width'] * self.tempo / (60 * self.beats_per_page)
+    
+    def on_scroll_frame(self, now, tick):
+        """连续滚动的每一帧：位置按经过的时间计算，晚到的帧直接跳到应在的位置"""
+        layout = self.page_layout
+        if not layout or not self.scroll_anchor:
+            self.stop_performance()
+            return
+        anchor_time, anchor_x = self.scroll_anchor
+        x = anchor_x + self.get_scroll_speed() * (now - anchor_time)
+        end = layout['total_width'] - self.canvas.winfo_width()
+        self.canvas.xview_moveto(min(x, end) / layout['total_width'])
+        if x >= end:
+            self.stop_performance()
+    
+    def on_beat(self, now, beat):
+        """每一拍：节拍器闪烁和提示音，按拍翻页时每beats_per_page拍翻一页"""
+        if self.metronome_enabled.get():
+            downbeat = beat % self.CONFIG['beats_per_measure'] == 0
+            self.beat_label.config(text=str(beat % self.CONFIG['beats_per_measure'] + 1),
+                                   bg='#e74c3c' if downbeat else '#4a90e2', fg='white')
+            self.beat_label.place(relx=1.0, x=-8, y=8, anchor='ne')
+            self.root.after(80, lambda: self.beat_label.config(bg='#dddddd', fg='#333333'))
+            self.root.bell()
+        
+        if self.performance_mode == 'page' and beat > 0 and beat % self.beats_per_page == 0:
+            layout = self.page_layout
+            if not layout:
+                self.stop_performance()
+                return
+            first_page, _ = self.get_visible_page_range()
+            if first_page + 1 >= layout['num_pages']:
+                self.stop_performance()
+                return
+            self.canvas.xview_moveto((first_page + 1) * layout['page_width'] / layout['total_width'])
+    
+    def show_tempo_settings(self):
+        """设置速度和每页拍数，运行中修改时从当前位置按新速度继续"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("演奏速度")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        tempo_var = tk.IntVar(value=self.tempo)
+        beats_var = tk.IntVar(value=self.beats_per_page)
+        tk.Label(dialog, text="速度（拍/分钟）：").grid(row=0, column=0, sticky='e', padx=10, pady=5)
+        tk.Spinbox(dialog, from_=self.CONFIG['tempo_min'], to=self.CONFIG['tempo_max'], textvariable=tempo_var,
+                   width=8).grid(row=0, column=1, padx=10, pady=5)
+        tk.Label(dialog, text="每页拍数：").grid(row=1, column=0, sticky='e', padx=10, pady=5)
+        tk.Spinbox(dialog, from_=1, to=self.CONFIG['beats_per_page_max'], textvariable=beats_var,
+                   width=8).grid(row=1, column=1, padx=10, pady=5)
+        
+        def apply():
+            try:
+                tempo = max(self.CONFIG['tempo_min'], min(self.CONFIG['tempo_max'], tempo_var.get()))
+                beats = max(1, min(self.CONFIG['beats_per_page_max'], beats_var.get()))
+            except tk.TclError:
+                messagebox.showwarning("警告", "请输入整数", parent=dialog)
+                return
+            self.tempo = tempo
+            self.beats_per_page = beats
+            self.save_config(self.CONFIG_KEYS['TEMPO'], str(tempo))
+            self.save_config(self.CONFIG_KEYS['BEATS_PER_PAGE'], str(beats))
+            dialog.destroy()
+            # 从现在的位置按新速度继续
+            if self.performance_mode:
+                self.start_performance(self.performance_mode)
+            elif self.beat_scheduler.running:
+                self.start_beats()
+        
+        ttk.Button(dialog, text="确定", command=apply).grid(row=2, column=0, columnspan=2, pady=10)
+        dialog.bind('<Return>', lambda e: apply())
+    
+    def schedule_memory_update(self):
+        """空闲时重新统计内存，合并同一轮事件中的多次更新"""
+        if not self.memory_update_pending:
+            self.memory_update_pending = True
+            self.root.after_idle(self.update_memory_usage)
+    
+    def update_memory_usage(self):
+        """统计界面持有的图像并执行总预算，淘汰缓存仍不够时释放不可见的页面"""
+        self.memory_update_pending = False
+        accountant = self.memory_accountant
+        if not self.measure_live_memory():
+            if not self.memory_pressure:
+                # 只在跨过预算时释放一次，之后不再预读页面，避免滚动时反复创建和释放
+                self.memory_pressure = True
+                self.reclaim_memory()
+                self.measure_live_memory()
+        elif self.memory_pressure and accountant.total_bytes() < accountant.max_bytes * 0.9:
+            self.memory_pressure = False
+        self.update_status_bar()
+    
+    def measure_live_memory(self):
+        """登记界面持有的PIL图像和PhotoImage的字节数，已在缓存中的图像不重复计算"""
+        cached = self.memory_accountant.cached_image_ids()
+        images = [self.current_image, self.page_image]
+        if self.current_pyramid is not None:
+            images.extend(self.current_pyramid.levels)
+        images.extend(page['bitmap'] for page in self.pages.values())
+        counted = set()
+        image_bytes = 0
+        for image in images:
+            if image is not None and id(image) not in cached and id(image) not in counted:
+                counted.add(id(image))
+                image_bytes += ImageLRUCache.image_bytes(image)
+        
+        # Tk以每像素4字节保存PhotoImage
+        photos = [page['photo'] for page in self.pages.values()]
+        photos.extend(photo for page in self.pages.values() for _, _, photo in page['overlays'])
+        if self.canvas.image is not None:
+            photos.append(self.canvas.image)
+        if self.thumbnail_grid is not None:
+            photos.extend(cell['photo'] for cell in self.thumbnail_grid['cells'] if cell.get('photo'))
+        photo_bytes = sum(photo.width() * photo.height() * 4 for photo in photos)
+        return self.memory_accountant.set_live(viewer=image_bytes, photo=photo_bytes)
+    
+    def reclaim_memory(self):
+        """缓存已全部淘汰仍超出总预算：释放可见范围以外的页面，可见页面连同遮罩都保留"""
+        if self.page_layout:
+            first_page, last_page = self.get_visible_page_range()
+            for i in list(self.pages):
+                if i < first_page or i > last_page:
+                    self.release_page(i)
+    
+    def update_status_bar(self):
+        """在状态栏显示内存占用，每秒刷新一次，后台线程中的缓存变化也能反映出来"""
+        if self.status_timer:
+            self.root.after_cancel(self.status_timer)
+        accountant = self.memory_accountant
+        names = {'decoded': '解码', 'scaled': '缩放', 'pages': '页面', 'viewer': '显示', 'photo': 'Tk图像'}
+        parts = [f"{names.get(name, name)} {nbytes / 1048576:.0f}" for name, nbytes in accountant.usage().items()]
+        self.status_bar.config(
+            text=f" 内存 {accountant.total_bytes() / 1048576:.0f} / {accountant.max_bytes / 1048576:.0f} MB"
+                 f"  （{'，'.join(parts)}）  淘汰 {accountant.evictions} 次"
+                 + ("  内存超出预算，只保留可见页面" if self.memory_pressure else "")
+        )
+        self.status_timer = self.root.after(1000, self.update_status_bar)
+    
+    def toggle_hud(self):
+        """显示或隐藏画布上的耗时信息"""
+        if self.hud_enabled.get():
+            self.hud.place(x=8, y=8)
+            self.update_hud()
+        else:
+            self.hud.place_forget()
+            if self.hud_timer:
+                self.root.after_cancel(self.hud_timer)
+                self.hud_timer = None
+    
+    def update_hud(self):
+        """刷新耗时信息，显示期间每半秒刷新一次"""
+        if not self.hud_enabled.get():
+            return
+        if self.hud_timer:
+            self.root.after_cancel(self.hud_timer)
+        
+        stages = ('open_file', 'decode', 'resize', 'preview', 'crop', 'page_disk_read', 'tile_read',
+                  'tint', 'compose', 'photoimage', 'canvas_items', 'show_image', 'list_directory', 'tree_insert',
+                  'config_write', 'image_config_write')
+        lines = [f"{stage:<20}{TRACER.last[stage] * 1000:8.1f} ms" for stage in stages if stage in TRACER.last]
+        stats = self.image_cache.stats()
+        lines.append(f"{'image cache':<20}{stats['hit_rate']:8.0%} 命中")
+        if self.page_layout:
+            lines.append(f"{'pages':<20}{len(self.pages):4d}/{self.page_layout['num_pages']}")
+        lines.append(f"{'memory':<20}{self.memory_accountant.total_bytes() / 1048576:8.0f} MB  "
+                     f"淘汰 {self.memory_accountant.evictions}")
+        for scheduler in (self.frame_scheduler, self.beat_scheduler):
+            summary = scheduler.running and scheduler.stats.summary()
+            if summary:
+                lines.append(f"{scheduler.name:<20}{summary['mean_ms']:8.1f} ms  抖动 {summary['jitter_ms']:.2f} ms  "
+                             f"p99 {summary['p99_ms']:.1f} ms  丢帧 {summary['dropped']}")
+        self.hud.config(text='\n'.join(lines))
+        self.hud_timer = self.root.after(500, self.update_hud)
+    
+    def request_profile(self):
+        """对下一次渲染做cProfile分析，包括后台线程中的高质量缩放"""
+        self.profile_requested = True
+        self.show_timed_message("将分析下一次渲染", 1)
+    
+    def finish_profile(self, generation, profiler):
+        """界面线程：后台缩放的分析完成，与界面线程部分的分析合并保存"""
+        if self.pending_profile is None or generation != self.profile_generation:
+            return
+        self.save_profile([self.pending_profile, profiler])
+        self.pending_profile = None
+        self.profile_generation = None
+    
+    def save_profile(self, profilers):
+        """保存分析结果并在控制台输出耗时最多的函数"""
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        path = os.path.join(self.get_cache_dir(), 'profiles', time.strftime('render-%Y%m%d-%H%M%S.prof'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stats.dump_stats(path)
+        stats.sort_stats('cumulative').print_stats(25)
+        self.show_timed_message(f"分析结果已保存：\n{path}")
+    
+    def export_trace(self):
+        """导出Chrome跟踪格式的性能记录，可在chrome://tracing或Perfetto中打开"""
+        path = os.path.join(self.get_cache_dir(), 'traces', time.strftime('trace-%Y%m%d-%H%M%S.json'))
+        try:
+            count = TRACER.export(path)
+        except OSError as e:
+            messagebox.showerror("错误", f"无法导出性能跟踪：{e}")
+            return
+        self.show_timed_message(f"已导出 {count} 条记录：\n{path}")
+    
     def show_favorites_manager(self):
         """显示藏夹管理窗口"""
         dialog = tk.Toplevel(self.root)
@@ -870,12 +4138,9 @@ class ImageViewer:
         dialog.transient(self.root)
         dialog.grab_set()
         
-        # 尝试��注册表加载位置
+        # 尝试从配置文件加载位置
         try:
-            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, self.REG_KEYS['PATH'], 0,
-                                winreg.KEY_READ)
-            pos = json.loads(winreg.QueryValueEx(key, self.REG_KEYS['FAVORITES_POS'])[0])
-            winreg.CloseKey(key)
+            pos = json.loads(self.load_config().get(self.CONFIG_KEYS['FAVORITES_POS'], ''))
             
             # 检查位置是否有效
             screen_width = self.root.winfo_screenwidth()
@@ -890,7 +4155,7 @@ class ImageViewer:
             
             # 设置位置
             dialog.geometry(f"+{pos['x']}+{pos['y']}")
-        except (WindowsError, ValueError, json.JSONDecodeError):
+        except (ValueError, KeyError, TypeError):
             # 果没有保存位置或位置无效，居中显示
             dialog_width = 500
             dialog_height = 400
@@ -945,15 +4210,8 @@ class ImageViewer:
         
         # 保存窗口位置
         def save_position():
-            try:
-                key = winreg.CreateKeyEx(winreg.HKEY_CURRENT_USER, self.REG_KEYS['PATH'], 0,
-                                       winreg.KEY_WRITE)
-                pos = {'x': dialog.winfo_x(), 'y': dialog.winfo_y()}
-                winreg.SetValueEx(key, self.REG_KEYS['FAVORITES_POS'], 0, winreg.REG_SZ,
-                                json.dumps(pos))
-                winreg.CloseKey(key)
-            except WindowsError as e:
-                print(f"无法保窗口位置: {e}")
+            pos = {'x': dialog.winfo_x(), 'y': dialog.winfo_y()}
+            self.save_config(self.CONFIG_KEYS['FAVORITES_POS'], json.dumps(pos))
         
         # 在口关闭时保存位置
         dialog.bind("<Configure>", lambda e: save_position() if e.widget == dialog else None)
@@ -1029,100 +4287,77 @@ class ImageViewer:
     def select_and_center_file(self, file_path):
         """选中文件并将其居中显示"""
         def try_center_file(retry_count=0):
-            # 遍历所有可见的项目
-            for item in self.tree.get_children(self.tree.focus()):
-                if self.tree.item(item)['values'][0] == file_path:
-                    # 选中文件
-                    self.tree.selection_set(item)
-                    self.tree.focus(item)
-                    
-                    # 先确保项目可见
-                    self.tree.see(item)
-                    
-                    # 等待一小段时间确保UI已更新
-                    self.root.update()
-                    
-                    # 获取项目的边界框
-                    bbox = self.tree.bbox(item)
-                    print(f"尝试次数: {retry_count + 1}")
-                    print(f"边界框信息: {bbox}")
-                    
-                    if not bbox and retry_count < 5:  # 最多重试5次
-                        print(f"无法获取边界框，将在200ms后重试")
-                        self.root.after(200, lambda: try_center_file(retry_count + 1))
-                        return
-                    
-                    if not bbox:
-                        print("警告: 多次尝试后仍无法取界框信��")
-                        return
-                    
-                    # 获取屏幕高度
-                    screen_height = self.root.winfo_screenheight()
-                    print(f"屏幕高度: {screen_height}")
-                    
-                    # 获取目录树在屏上的位置
-                    tree_y = self.tree.winfo_rooty()
-                    print(f"目录树Y坐标: {tree_y}")
-                    
-                    # 获取项目在目录树中的相对位置
-                    item_y = bbox[1]  # bbox[1] 是项目的y坐标
-                    print(f"目相对Y坐标: {item_y}")
-                    
-                    # 计算项目在屏幕上的绝对位置
-                    absolute_item_y = tree_y + item_y
-                    print(f"项目绝对Y坐标: {absolute_item_y}")
-                    
-                    # 计算到屏幕中心的距离
-                    target_y = screen_height / 2
-                    print(f"目标Y坐标: {target_y}")
-                    print(f"需要调整的距离: {absolute_item_y - target_y}")
-                    
-                    # 将距离转换为滚动单位
-                    tree_height = float(self.tree.winfo_height())
-                    scroll_fraction = (absolute_item_y - target_y) / tree_height
-                    print(f"滚动比例: {scroll_fraction}")
-                    
-                    # 获取当前滚动位置
-                    current_pos = self.tree.yview()[0]
-                    print(f"当前滚动位置: {current_pos}")
-                    
-                    # 计算新的滚动位置
-                    new_pos = current_pos + scroll_fraction
-                    new_pos = max(0.0, min(1.0, new_pos))
-                    print(f"新的滚动位置: {new_pos}")
-                    
-                    # 应用滚动
-                    self.tree.yview_moveto(new_pos)
-                    
-                    # 触发选择事件来显示图片
-                    self.on_tree_select(None)
-                    break
+            # 通过路径索引查找文件节点
+            item = self.find_tree_item(file_path)
+            if item:
+                # 选中文件
+                self.tree.selection_set(item)
+                self.tree.focus(item)
+                
+                # 先确保项目可见
+                self.tree.see(item)
+                
+                # 等待一小段时间确保UI已更新
+                self.root.update()
+                
+                # 获取项目的边界框
+                bbox = self.tree.bbox(item)
+                print(f"尝试次数: {retry_count + 1}")
+                print(f"边界框信息: {bbox}")
+                
+                if not bbox and retry_count < 5:  # 最多重试5次
+                    print(f"无法获取边界框，将在200ms后重试")
+                    self.root.after(200, lambda: try_center_file(retry_count + 1))
+                    return
+                
+                if not bbox:
+                    print("警告: 多次尝试后仍无法取界框信��")
+                    return
+                
+                # 获取屏幕高度
+                screen_height = self.root.winfo_screenheight()
+                print(f"屏幕高度: {screen_height}")
+                
+                # 获取目录树在屏上的位置
+                tree_y = self.tree.winfo_rooty()
+                print(f"目录树Y坐标: {tree_y}")
+                
+                # 获取项目在目录树中的相对位置
+                item_y = bbox[1]  # bbox[1] 是项目的y坐标
+                print(f"目相对Y坐标: {item_y}")
+                
+                # 计算项目在屏幕上的绝对位置
+                absolute_item_y = tree_y + item_y
+                print(f"项目绝对Y坐标: {absolute_item_y}")
+                
+                # 计算到屏幕中心的距离
+                target_y = screen_height / 2
+                print(f"目标Y坐标: {target_y}")
+                print(f"需要调整的距离: {absolute_item_y - target_y}")
+                
+                # 将距离转换为滚动单位
+                tree_height = float(self.tree.winfo_height())
+                scroll_fraction = (absolute_item_y - target_y) / tree_height
+                print(f"滚动比例: {scroll_fraction}")
+                
+                # 获取当前滚动位置
+                current_pos = self.tree.yview()[0]
+                print(f"当前滚动位置: {current_pos}")
+                
+                # 计算新的滚动位置
+                new_pos = current_pos + scroll_fraction
+                new_pos = max(0.0, min(1.0, new_pos))
+                print(f"新的滚动位置: {new_pos}")
+                
+                # 应用滚动
+                self.tree.yview_moveto(new_pos)
+                
+                # 触发选择事件来显示图片
+                self.on_tree_select(None)
         
         # 开始尝试居中显示
         try_center_file()
     
-    def handle_registry_error(self, operation, error):
-        """统一处理注册表操作错误"""
-        print(f"注册表{operation}错误: {error}")
-        if isinstance(error, WindowsError):
-            if error.winerror == 2:  # 找不到注册表键
-                return None
-        return False
-    
-    def registry_operation(self, operation, key, value=None):
-        """统一处理注册表操作"""
-        try:
-            reg_key = winreg.CreateKeyEx(winreg.HKEY_CURRENT_USER, self.REG_KEYS['PATH'], 0,
-                                       winreg.KEY_WRITE if value else winreg.KEY_READ)
-            if value:
-                winreg.SetValueEx(reg_key, key, 0, winreg.REG_SZ, value)
-            else:
-                value = winreg.QueryValueEx(reg_key, key)[0]
-            winreg.CloseKey(reg_key)
-            return value
-        except Exception as e:
-            return self.handle_registry_error(operation, e)
-    
     def show_help(self):
         """显示帮助窗口"""
         help_text = """
@@ -1140,13 +4375,15 @@ class ImageViewer:
 
 6. 在任意文件或文件夹上点击鼠标右键，该文件或文件夹会被自动收藏到收藏夹。被收藏过的文件或文件夹会以加粗的形式进行显示。在菜单栏的"收藏夹"菜单中可以快捷访问这些收藏的文件或文件夹，也可以进行整理。最多可收藏50个项目。
 
-7. 目录框架的宽度可以通过拖动目录框架与图片框架之间的分隔条来进行调节。
+7. 目录框架的宽度可以通过拖动目录框架与图片框架之间的分隔条来进行调节。按Ctrl+R或点击"排序"菜单中的"刷新目录"可以重新读取当前目录。
 
 8. 软件具有记忆功能，可以记录每个浏览过的文件的大小、重复比例等信息；还可以记忆遮罩开关状态、最后一次访问的文件或文件夹、目录框架宽度等信息。记忆的信息存放在与软件同一个文件夹下的setup.ini文件中。如删除此文件，所有记忆的信息将丢失。
 
-9. 在每个浏览过图片的文件夹中，会生成一个名为image_config.json的文件，该文件记录了被浏览过的图片的展示信息，如切分大小，遮罩大小等。没有被浏览过的图片不会在此文件中留下信息，浏览过但是又被删除了的图片，信息会从此文件中移除。如果删除此文件，所有记忆的信息将丢失。
+9. 在目录框架上方的搜索框中输入文件名可以查找图片。搜索范围可在"搜索"菜单中添加或移除，保存在setup.ini的SearchRoots中；未设置时使用收藏夹中的目录，但不包括C:\\这样的磁盘根目录。
+
+10. 在每个浏览过图片的文件夹中，会生成一个名为image_config.json的文件，该文件记录了被浏览过的图片的展示信息，如切分大小，遮罩大小等。没有被浏览过的图片不会在此文件中留下信息，浏览过但是又被删除了的图片，信息会从此文件中移除。如果删除此文件，所有记忆的信息将丢失。
 
-10. Have Fun!
+11. Have Fun!
 
 """
 
@@ -1213,27 +4450,18 @@ class ImageViewer:
             current_path = self.tree.item(current_node)['values'][0]
         
         # 保存排序方法到配置文件
-        config_path = os.path.join(current_path, self.config_filename)
-        try:
-            # 读取现有配置
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    configs = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                configs = {}
-            
-            # 更新排序方法
-            configs['sort_method'] = sort_method
-            
-            # 保存配置
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(configs, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"无法保存排序方法: {e}")
+        self.update_image_config(current_path, 'sort_method', sort_method)
+        
+        # 目录列表已缓存时只重新排列已有的节点，不访问文件系统
+        job = self.populate_jobs.get(current_node)
+        time_sort = sort_method in ('time_desc', 'time_asc')
+        if (job and job['done'] and
+                self.listing_cache.get(current_path, time_sort, validate=False) is not None):
+            self.sync_node_children(current_node)
+            return
         
         # 清空当前目录下的所有项目
-        for item in self.tree.get_children(current_node):
-            self.tree.delete(item)
+        self.delete_tree_children(current_node)
         
         # 重新填充目录
         self.populate_node(current_node)
@@ -1250,36 +4478,454 @@ class ImageViewer:
         else:
             current_path = None
         
-        # 获取当前焦点项目（通常是当前目录）
+        # 获取当前焦点项目（通常是当前目录），焦点在文件上时刷新其所在目录
         current_node = self.tree.focus()
         if not current_node:
             return
+        if os.path.isfile(self.tree.item(current_node)['values'][0]):
+            current_node = self.tree.parent(current_node)
+            if not current_node:
+                return
+        
+        # 已展开的目录重新扫描后增量更新，选中和展开状态保持不变
+        job = self.populate_jobs.get(current_node)
+        if job and job['done']:
+            self.listing_executor.submit(self.update_directory_listing, job['path'], None)
+            return
         
-        # 清空当前目录下的所有项目
-        for item in self.tree.get_children(current_node):
-            self.tree.delete(item)
+        # 丢弃缓存的列表，监视器漏掉的变化（如网络驱动器上的修改）也能显示出来
+        self.listing_cache.invalidate(self.tree.item(current_node)['values'][0])
         
-        # 重新填充目录
-        self.populate_node(current_node)
+        # 清空当前目录下的所有项目
+        self.delete_tree_children(current_node)
         
-        # 如果之前有选中的项目，尝试重新选中
-        if current_path:
-            for item in self.tree.get_children(current_node):
-                if self.tree.item(item)['values'][0] == current_path:
+        # 如果之前有选中的项目，填充完成后尝试重新选中
+        def reselect():
+            if current_path:
+                item = self.find_tree_item(current_path)
+                if item:
                     self.tree.selection_set(item)
-                    break
+        
+        # 重新填充目录
+        self.populate_node(current_node, reselect)
     
     def get_sort_method(self, directory):
         """获取目录的排序方法"""
-        config_path = os.path.join(directory, self.config_filename)
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                configs = json.load(f)
-                return configs.get('sort_method', 'name_asc')  # 默认按名称升序
-        except (FileNotFoundError, json.JSONDecodeError):
+        configs = self.read_image_configs(directory)
+        if configs is None:
             return 'name_asc'  # 默认按名称升序
+        return configs.get('sort_method', 'name_asc')  # 默认按名称升序
 
-if __name__ == "__main__":
+def prewarm_file(path, scale, overlap_ratio, canvas_height, cache_dir, max_bytes):
+    """预渲染进程：渲染一个文件缺少的页面并写入页面磁盘缓存，返回写入的页数"""
+    cache = PageDiskCache(os.path.join(cache_dir, 'pages'), max_bytes)
+    width, height = read_image_size(path)
+    size = (int(width * scale), int(height * scale))
+    if size[1] <= canvas_height:
+        return 0  # 不分页的图片直接显示，不使用页面缓存
+    
+    layout = compute_page_layout(size[0], size[1], canvas_height, overlap_ratio)
+    key_prefix = DecodedImageCache.make_key(path) + (scale, canvas_height, overlap_ratio)
+    missing = [i for i in range(layout['num_pages']) if key_prefix + (i,) not in cache]
+    if not missing:
+        return 0
+    
+    # 与查看器相同的解码和缩放方式，预算为0的缓存只解码不保留
+    image = DecodedImageCache(0).load(path, scale)
+    page_image = ImagePyramid(image).resize(size, Image.Resampling.LANCZOS)
+    for i in missing:
+        cache.put(key_prefix + (i,), page_image.crop(get_page_box(layout, i)))
+    return len(missing)
+
+def read_cli_settings(setup_path):
+    """命令行任务读取setup.ini中的设置，配置键和默认值与ImageViewer一致"""
+    config = ConfigStore(setup_path, 'Favorites')
+    try:
+        page_disk_cache_mb = int(config.get('PageDiskCacheMB', 2048))
+    except ValueError:
+        page_disk_cache_mb = 2048
+    try:
+        tile_cache_mb = int(config.get('TileCacheMB', 8192))
+    except ValueError:
+        tile_cache_mb = 8192
+    try:
+        canvas_height = int(config.get('CanvasHeight', 0) or 0)
+    except ValueError:
+        canvas_height = 0
+    return {
+        'cache_dir': os.path.abspath(config.get('CacheDir', '') or 'cache'),
+        'page_disk_cache_bytes': page_disk_cache_mb * 1024 * 1024,
+        'tile_cache_bytes': tile_cache_mb * 1024 * 1024,
+        'canvas_height': canvas_height
+    }
+
+def collect_library_files(paths):
+    """列出目录（递归）或文件中的图片，以及每个图片在image_config.json中保存的缩放比例和重叠比例
+    
+    返回[(图片路径, 所在根目录, 缩放比例, 重叠比例)]。
+    """
+    image_configs = DirectoryConfigCache("image_config.json")
+    files = []
+    for root_path in paths:
+        root_path = os.path.abspath(root_path)
+        if os.path.isfile(root_path):
+            candidates = [root_path]
+            root_path = os.path.dirname(root_path)
+        else:
+            candidates = [
+                os.path.join(directory, name)
+                for directory, _, names in os.walk(root_path)
+                for name in sorted(names)
+            ]
+        for path in candidates:
+            if not path.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            configs = image_configs.get(os.path.dirname(path)) or {}
+            config = configs.get(os.path.basename(path), {})
+            files.append((path, root_path, config.get('scale', 1.0), config.get('overlap_ratio', 0.2)))
+    return files
+
+def run_prewarm(argv):
+    """预渲染曲库：按各图片保存的缩放比例和重叠比例，用多个进程渲染所有页面"""
+    parser = argparse.ArgumentParser(prog='main.py prewarm', description="预渲染曲库中所有乐谱的页面")
+    parser.add_argument('paths', nargs='+', help="要预渲染的目录或图片")
+    parser.add_argument('--canvas-height', type=int, help="画布高度，默认使用查看器上次记录的高度")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="进程数")
+    parser.add_argument('--setup', default='setup.ini', help="配置文件路径")
+    args = parser.parse_args(argv)
+    
+    settings = read_cli_settings(args.setup)
+    cache_dir = settings['cache_dir']
+    max_bytes = settings['page_disk_cache_bytes']
+    canvas_height = args.canvas_height or settings['canvas_height']
+    if canvas_height <= 1:
+        print("未记录画布高度，请先用查看器打开一次乐谱，或使用--canvas-height指定")
+        return 2
+    
+    # 收集文件及其保存的显示设置
+    tasks = [(path, scale, overlap_ratio) for path, _, scale, overlap_ratio in collect_library_files(args.paths)]
+    
+    start = time.perf_counter()
+    written = 0
+    failed = 0
+    with make_process_pool(args.workers) as executor:
+        futures = {
+            executor.submit(prewarm_file, path, scale, overlap_ratio, canvas_height, cache_dir, max_bytes): path
+            for path, scale, overlap_ratio in tasks
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                pages = future.result()
+                written += pages
+                print(f"[{done}/{len(futures)}] {futures[future]}: {pages} 页")
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(futures)}] {futures[future]}: 出错: {e}")
+    
+    # 各进程分别写入，结束后统一按容量淘汰
+    PageDiskCache(os.path.join(cache_dir, 'pages'), max_bytes).trim()
+    print(f"完成: {len(tasks)} 个文件, 写入 {written} 页, 失败 {failed} 个, "
+          f"用时 {time.perf_counter() - start:.1f} 秒")
+    return 1 if failed else 0
+
+def export_file(path, output_dir, fmt, scale, overlap_ratio, page_height, quality, cache_dir, tiled_threshold):
+    """导出进程：按查看器的分页方式把一个图片导出为页面文件，返回(页数, 源像素数, 写入字节数)
+    
+    页面逐页生成并立即写出，不保留已写出的页面；超大图像通过磁盘分级缓存按页读取，不完整解码。
+    """
+    width, height = read_image_size(path)
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    layout = compute_page_layout(size[0], size[1], page_height, overlap_ratio)
+    
+    tiles = None
+    if width * height > tiled_threshold:
+        cache_path = TiledImageStore.cache_path_for(cache_dir, DecodedImageCache.make_key(path))
+        tiles = TiledImageStore.open(cache_path) or TiledImageStore.build(path, cache_path)
+        render = lambda box: tiles.read_region(size, box)
+    else:
+        # 缩小时按2的幂缩小解码，之后每页只重采样本页对应的源区域
+        image = DecodedImageCache(0).load(path, scale)
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        ratio_x = image.size[0] / size[0]
+        ratio_y = image.size[1] / size[1]
+        render = lambda box: image.resize(
+            (box[2] - box[0], box[3] - box[1]), Image.Resampling.LANCZOS,
+            box=(box[0] * ratio_x, box[1] * ratio_y, box[2] * ratio_x, box[3] * ratio_y)
+        )
+    
+    def pages():
+        for i in range(layout['num_pages']):
+            page = render(get_page_box(layout, i))
+            # PDF和JPEG不支持透明通道
+            if fmt != 'png' and page.mode not in ('L', 'RGB'):
+                page = page.convert('RGB')
+            yield page
+    
+    # 保留源文件的扩展名，同一目录中的song.png和song.jpg不会写到同一个输出文件
+    name, source_extension = os.path.splitext(os.path.basename(path))
+    stem = f"{name}_{source_extension[1:].lower()}" if source_extension else name
+    os.makedirs(output_dir, exist_ok=True)
+    
+    def write(output_path, save):
+        """先写入临时文件再替换，导出中断时不会留下不完整的文件"""
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=output_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                save(f)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return os.path.getsize(output_path)
+    
+    written = 0
+    try:
+        if fmt == 'pdf':
+            # 多页PDF：append_images逐页取出并编码，已写入的页面随即释放
+            page_iter = pages()
+            written = write(os.path.join(output_dir, stem + '.pdf'), lambda f: next(page_iter).save(
+                f, 'PDF', save_all=True, append_images=page_iter, resolution=150
+            ))
+        else:
+            extension = 'jpg' if fmt == 'jpeg' else 'png'
+            for i, page in enumerate(pages(), 1):
+                output_path = os.path.join(output_dir, f"{stem}_p{i:03d}.{extension}")
+                if fmt == 'jpeg':
+                    written += write(output_path, lambda f: page.save(f, 'JPEG', quality=quality))
+                else:
+                    written += write(output_path, lambda f: page.save(f, 'PNG'))
+            
+            # 删除上次导出时多出的页面（缩放比例或页面高度改变后页数可能变少）
+            i = layout['num_pages'] + 1
+            while True:
+                output_path = os.path.join(output_dir, f"{stem}_p{i:03d}.{extension}")
+                if not os.path.exists(output_path):
+                    break
+                os.remove(output_path)
+                i += 1
+    finally:
+        if tiles is not None:
+            tiles.close()
+    return layout['num_pages'], width * height, written
+
+def run_export(argv):
+    """批量导出：按各图片保存的缩放比例和重叠比例分页，用多个进程导出为PNG、JPEG或多页PDF"""
+    parser = argparse.ArgumentParser(prog='main.py export', description="按查看器的分页方式批量导出页面")
+    parser.add_argument('paths', nargs='+', help="要导出的目录或图片")
+    parser.add_argument('-o', '--output', required=True, help="输出目录，保持源目录的层次结构")
+    parser.add_argument('-f', '--format', choices=('png', 'jpeg', 'pdf'), default='png', help="输出格式")
+    parser.add_argument('--page-height', type=int, help="页面高度，默认使用查看器上次记录的画布高度")
+    parser.add_argument('--quality', type=int, default=90, help="JPEG质量")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="进程数")
+    parser.add_argument('--tiled-threshold-mpx', type=int, default=100,
+                        help="超过多少百万像素的图像通过磁盘分级缓存分页读取")
+    parser.add_argument('--setup', default='setup.ini', help="配置文件路径")
+    args = parser.parse_args(argv)
+    
+    settings = read_cli_settings(args.setup)
+    page_height = args.page_height or settings['canvas_height']
+    if page_height <= 1:
+        print("未记录画布高度，请先用查看器打开一次乐谱，或使用--page-height指定")
+        return 2
+    output_root = os.path.abspath(args.output)
+    files = collect_library_files(args.paths)
+    
+    start = time.perf_counter()
+    total_pages = 0
+    total_pixels = 0
+    total_bytes = 0
+    failed = 0
+    with make_process_pool(args.workers) as executor:
+        futures = {}
+        for path, root_path, scale, overlap_ratio in files:
+            output_dir = os.path.join(output_root, os.path.relpath(os.path.dirname(path), os.path.dirname(root_path)))
+            future = executor.submit(
+                export_file, path, output_dir, args.format, scale, overlap_ratio, page_height,
+                args.quality, settings['cache_dir'], args.tiled_threshold_mpx * 1000000
+            )
+            futures[future] = path
+        
+        # 每完成一个文件输出一行，并报告到目前为止的吞吐量
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                pages, pixels, written = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(futures)}] {futures[future]}: 出错: {e}")
+                continue
+            total_pages += pages
+            total_pixels += pixels
+            total_bytes += written
+            elapsed = time.perf_counter() - start
+            print(f"[{done}/{len(futures)}] {futures[future]}: {pages} 页, "
+                  f"{total_pages / elapsed:.1f} 页/秒, {total_pixels / elapsed / 1000000:.1f} 百万像素/秒")
+    
+    # 各进程分别建立超大图像的分级缓存，结束后统一按容量淘汰
+    TiledImageStore.trim(settings['cache_dir'], settings['tile_cache_bytes'])
+    elapsed = time.perf_counter() - start
+    print(f"完成: {len(files)} 个文件, {total_pages} 页, 失败 {failed} 个, 用时 {elapsed:.1f} 秒")
+    if elapsed > 0:
+        print(f"吞吐量: {len(files) / elapsed:.2f} 文件/秒, {total_pages / elapsed:.1f} 页/秒, "
+              f"源图像 {total_pixels / elapsed / 1000000:.1f} 百万像素/秒, "
+              f"写入 {total_bytes / elapsed / 1024 / 1024:.1f} MB/秒")
+    return 1 if failed else 0
+
+def make_benchmark_image(width, height):
+    """生成类似乐谱的测试图像：白底上的五线谱和随机的音符"""
+    import random
+    
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    rng = random.Random(width * 100003 + height)
+    for staff_top in range(60, height - 100, 180):
+        for line in range(5):
+            y = staff_top + line * 12
+            draw.line((40, y, width - 40, y), fill=(30, 30, 30), width=2)
+        for _ in range(width // 60):
+            x = rng.randrange(60, width - 60)
+            y = staff_top + rng.randrange(-12, 60)
+            draw.ellipse((x, y, x + 14, y + 10), fill=(0, 0, 0))
+            draw.line((x + 13, y + 5, x + 13, y - 35), fill=(0, 0, 0), width=2)
+    return image
+
+def time_stage(func, repeat):
+    """多次执行并返回耗时的中位数（秒）"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def benchmark_file(path, size, layout, args, tk_root):
+    """测量一个测试图像在渲染路径各阶段的耗时，中间结果在返回后随局部变量一起释放"""
+    timings = {}
+    
+    def decode_full():
+        with Image.open(path) as image:
+            image.load()
+    timings['decode'] = time_stage(decode_full, args.repeat)
+    
+    # 按缩放比例缩小解码，与查看器相同
+    timings['decode_reduced'] = time_stage(lambda: DecodedImageCache(0).load(path, args.scale), args.repeat)
+    decoded = DecodedImageCache(0).load(path, args.scale)
+    
+    # 缩放从完整分辨率开始，包括生成金字塔级别的时间，相当于在查看器中改变缩放比例
+    scaled = benchmark_resize(path, size, args.repeat, timings)
+    timings['preview'] = time_stage(
+        lambda: ImagePyramid(decoded).preview_region(size, get_page_box(layout, 0)), args.repeat
+    )
+    
+    # 布局只做几何计算，耗时很短，重复多次再平均
+    layout_rounds = 1000
+    timings['layout'] = time_stage(lambda: [
+        [get_page_descriptor(layout, i) for i in range(layout['num_pages'])]
+        for _ in range(layout_rounds)
+    ], args.repeat) / layout_rounds
+    
+    pages = []
+    timings['crop'] = time_stage(lambda: pages.__setitem__(slice(None), [
+        scaled.crop(get_page_box(layout, i)) for i in range(layout['num_pages'])
+    ]), args.repeat)
+    
+    if tk_root is not None:
+        timings['photoimage'] = time_stage(
+            lambda: [ImageTk.PhotoImage(page) for page in pages], args.repeat
+        )
+    return timings
+
+def benchmark_resize(path, size, repeat, timings):
+    """测量从完整分辨率缩放的耗时并返回缩放结果，完整分辨率的图像在返回后释放"""
+    with Image.open(path) as full:
+        full.load()
+    scaled = []
+    timings['resize'] = time_stage(
+        lambda: scaled.append(ImagePyramid(full).resize(size, Image.Resampling.LANCZOS)), repeat
+    )
+    return scaled[-1]
+
+def run_benchmark(argv):
+    """渲染路径的性能测试：在合成的长图上分别测量解码、缩放、布局、裁剪和PhotoImage转换的耗时"""
+    parser = argparse.ArgumentParser(prog='main.py bench', description="测量渲染路径各阶段的耗时")
+    parser.add_argument('--sizes', nargs='+', default=['2000x5000', '3000x20000', '3000x60000'],
+                        help="测试图像尺寸，格式为 宽x高")
+    parser.add_argument('--canvas-height', type=int, default=1000, help="分页使用的画布高度")
+    parser.add_argument('--scale', type=float, default=0.6,
+                        help="缩放比例；2的幂（如0.5）时金字塔直接给出结果，不经过LANCZOS重采样")
+    parser.add_argument('--overlap', type=float, default=0.2, help="重叠比例")
+    parser.add_argument('--repeat', type=int, default=3, help="每个阶段重复的次数，取中位数")
+    parser.add_argument('--format', choices=('jpeg', 'png'), default='jpeg', help="测试图像的文件格式")
+    parser.add_argument('--json', help="把结果写入JSON文件，便于在版本之间比较")
+    args = parser.parse_args(argv)
+    
+    # 测试图像超过Pillow的解压炸弹限制
+    Image.MAX_IMAGE_PIXELS = None
+    
+    # PhotoImage需要Tk，没有可用的显示时跳过该阶段
+    try:
+        tk_root = tk.Tk()
+        tk_root.withdraw()
+    except tk.TclError as e:
+        print(f"没有可用的显示，跳过PhotoImage转换: {e}")
+        tk_root = None
+    
+    results = []
+    with tempfile.TemporaryDirectory(prefix='viewer-bench-') as temp_dir:
+        for size_text in args.sizes:
+            width, height = (int(v) for v in size_text.lower().split('x'))
+            path = os.path.join(temp_dir, f"{width}x{height}.{'jpg' if args.format == 'jpeg' else 'png'}")
+            make_benchmark_image(width, height).save(path, quality=90)
+            
+            size = (int(width * args.scale), int(height * args.scale))
+            layout = compute_page_layout(size[0], size[1], args.canvas_height, args.overlap)
+            timings = benchmark_file(path, size, layout, args, tk_root)
+            
+            results.append({
+                'size': [width, height],
+                'scaled_size': list(size),
+                'num_pages': layout['num_pages'],
+                'seconds': timings
+            })
+            print(f"{width}x{height} -> {size[0]}x{size[1]}, {layout['num_pages']} 页")
+            for stage, seconds in timings.items():
+                print(f"  {stage:<16}{seconds * 1000:>12.3f} ms")
+    
+    if tk_root is not None:
+        tk_root.destroy()
+    
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'pillow': Image.__version__,
+                'python': sys.version.split()[0],
+                'canvas_height': args.canvas_height,
+                'scale': args.scale,
+                'overlap': args.overlap,
+                'results': results
+            }, f, indent=4)
+    return 0
+
+def main(argv):
+    """不带参数时启动查看器，带子命令时执行不需要界面的批处理任务"""
+    # 打包为可执行文件后，进程池的子进程从这里进入，必须最先处理
+    multiprocessing.freeze_support()
+    commands = {
+        'prewarm': run_prewarm,
+        'export': run_export,
+        'bench': run_benchmark
+    }
+    if argv and argv[0] in commands:
+        return commands[argv[0]](argv[1:])
     root = tk.Tk()
     app = ImageViewer(root)
+    app.mark_startup('window')
     root.mainloop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
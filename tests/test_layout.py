@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (PAGE_MARGIN, compute_page_layout, get_overlap_rows, get_page_box,
+                  get_page_descriptor)
+
+
+class PageLayoutTest(unittest.TestCase):
+    def setUp(self):
+        # 画布高1000，重叠20%：每页前进800行
+        self.layout = compute_page_layout(600, 2500, 1000, 0.2)
+
+    def test_page_count(self):
+        self.assertEqual(self.layout['overlap'], 200)
+        self.assertEqual(self.layout['effective_height'], 800)
+        self.assertEqual(self.layout['num_pages'], 4)
+        self.assertEqual(self.layout['total_width'], 4 * (600 + 20))
+        # 正好整除时不多出一页
+        self.assertEqual(compute_page_layout(600, 1600, 1000, 0.2)['num_pages'], 2)
+
+    def test_page_boxes(self):
+        self.assertEqual(get_page_box(self.layout, 0), (0, 0, 600, 1000))
+        self.assertEqual(get_page_box(self.layout, 1), (0, 800, 600, 1800))
+        # 最后一页截止到图像底部
+        self.assertEqual(get_page_box(self.layout, 3), (0, 2400, 600, 2500))
+
+    def test_overlap_rows(self):
+        first = get_page_descriptor(self.layout, 0)
+        middle = get_page_descriptor(self.layout, 1)
+        last = get_page_descriptor(self.layout, 3)
+        self.assertEqual(get_overlap_rows(self.layout, first), [(800, 1000)])
+        self.assertEqual(get_overlap_rows(self.layout, middle), [(0, 200), (800, 1000)])
+        self.assertEqual(get_overlap_rows(self.layout, last), [(0, 200)])
+        self.assertEqual(middle.separator_ys, (200 + PAGE_MARGIN, 800 + PAGE_MARGIN))
+        # 上一页底部的重叠行与下一页顶部的重叠行是图像中的同一段
+        (first_top, first_bottom), = get_overlap_rows(self.layout, first)
+        middle_top, middle_bottom = get_overlap_rows(self.layout, middle)[0]
+        self.assertEqual((first.box[1] + first_top, first.box[1] + first_bottom),
+                         (middle.box[1] + middle_top, middle.box[1] + middle_bottom))
+
+    def test_descriptor_position(self):
+        page = get_page_descriptor(self.layout, 2)
+        self.assertEqual(page.index, 2)
+        self.assertEqual(page.x, 2 * 620 + PAGE_MARGIN)
+        self.assertEqual(page.border, (page.x - 5, 5, page.x + 605, 995))
+
+
+if __name__ == '__main__':
+    unittest.main()